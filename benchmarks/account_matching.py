@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+"""Times matching.AccountMatcher against the list comprehension that
+legacy.prompt_for_account used before, typing a few account names one
+keystroke at a time into a list of 10000 synthetic accounts.
+
+Run with PYTHONPATH=src python3 benchmarks/account_matching.py [accounts]
+"""
+
+import sys
+import time
+
+from ledgerhelpers import matching
+
+
+def generate_accounts(count):
+    tops = ["Assets", "Expenses", "Income", "Liabilities", "Equity"]
+    return [
+        "%s:Category %d:Subcategory %d" % (tops[n % len(tops)], n // 100, n)
+        for n in range(count)
+    ]
+
+
+def keystrokes(words):
+    for word in words:
+        for n in range(1, len(word) + 1):
+            yield word[:n]
+
+
+def timed(f, inputs):
+    start = time.time()
+    result = [f(inp) for inp in inputs]
+    return result, (time.time() - start) / len(inputs)
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    accounts = generate_accounts(count)
+    inputs = list(keystrokes(
+        ["expenses:category 42", "subcategory 4321", "liab", "nothing"]
+    ))
+    start = time.time()
+    matcher = matching.AccountMatcher()
+    for account in accounts:
+        matcher.add(account)
+    # The first completion builds the indexes.
+    matcher.complete("a", 1)
+    print("%d accounts, matcher built in %.3f seconds" % (
+        count, time.time() - start
+    ))
+    result, elapsed = timed(lambda inp: matcher.complete(inp, 1), inputs)
+    print("AccountMatcher:          %.3f ms per keystroke" % (elapsed * 1000))
+    _, elapsed = timed(
+        lambda inp: [a for a in accounts if inp.lower() in a.lower()][:1],
+        inputs,
+    )
+    print("previous list filtering: %.3f ms per keystroke" % (elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+"""Times journal.harvest_ledger_text against the implementation of
+JournalParser.harvest_accounts_and_last_commodities it replaced, on a
+synthetic journal of 100000 transactions with two to five postings
+each, some of them in annotated commodities.  Both include the time
+ledger takes to parse the journal.  Needs the ledger Python bindings.
+
+Run with PYTHONPATH=src python3 benchmarks/harvest_accounts.py [transactions]
+"""
+
+import datetime
+import sys
+import time
+
+import ledger
+
+from ledgerhelpers.journal import harvest_ledger_text
+
+
+def previous_harvest_accounts_and_last_commodities(journal):
+    accts = []
+    commos = dict()
+    amts = dict()
+    for post in journal.query(""):
+        for subpost in post.xact.posts():
+            if str(subpost.account) not in accts:
+                accts.append(str(subpost.account))
+            comm = ledger.Amount(1).with_commodity(subpost.amount.commodity)
+            comm.commodity = comm.commodity.strip_annotations()
+            commos[str(subpost.account)] = str(comm)
+            amts[str(comm)] = True
+    return accts, commos, [str(k) for k in list(amts.keys())]
+
+
+def generate_journal(transactions):
+    commodities = ["USD", "CHF", "EUR", "10 AAPL {100 USD}"]
+    lines = []
+    for n in range(transactions):
+        day = datetime.date(2000, 1, 1) + datetime.timedelta(n // 100)
+        lines.append("%s payee %d" % (day, n % 1000))
+        postings = 2 + n % 4
+        for m in range(postings - 1):
+            commodity = commodities[(n + m) % len(commodities)]
+            if " " not in commodity:
+                commodity = "1 " + commodity
+            lines.append("    Expenses:Category %d:Item %d  %s" % (
+                n % 50, (n + m) % 300, commodity
+            ))
+        lines.append("    Assets:Account %d" % (n % 20))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv):
+    transactions = int(argv[1]) if len(argv) > 1 else 100000
+    text = generate_journal(transactions)
+    start = time.time()
+    accounts, last, commodities, _ = harvest_ledger_text(text, dict())
+    print("harvest_ledger_text:                            %.3f seconds"
+          % (time.time() - start))
+    start = time.time()
+    expected = previous_harvest_accounts_and_last_commodities(
+        ledger.Session().read_journal_from_string(text)
+    )
+    print("previous harvest_accounts_and_last_commodities: %.3f seconds"
+          % (time.time() - start))
+    assert accounts == expected[0]
+    assert last == expected[1]
+    assert commodities == expected[2]
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+"""Measures how many bytes withdraw-cli writes to its settings file for
+one run, with Settings as it is and with the pickle-on-every-change
+Settings it replaced, for a suggester that learned a few years of
+associations.
+
+Run with PYTHONPATH=src python3 benchmarks/settings_writes.py [associations]
+"""
+
+import datetime
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+import ledgerhelpers
+
+
+class PreviousSettings(ledgerhelpers.Settings):
+
+    def __setitem__(self, item, value):
+        self.data[item] = value
+        self.previous_persist()
+
+    def __delitem__(self, item):
+        if item in self.data:
+            del self.data[item]
+            self.previous_persist()
+
+    def previous_persist(self):
+        p = open(self.filename, "wb")
+        pickle.dump(self.data, p)
+        p.flush()
+        p.close()
+        self.written += os.path.getsize(self.filename)
+
+
+class CountingSettings(ledgerhelpers.Settings):
+
+    def persist(self):
+        ledgerhelpers.Settings.persist(self)
+        self.written += os.path.getsize(self.filename)
+
+
+def suggester(associations):
+    s = ledgerhelpers.AccountSuggester()
+    for n in range(associations):
+        s.associate(
+            "payee %d shop %d" % (n % 5000, n % 17),
+            "Expenses:Category %d" % (n % 300),
+        )
+    return s
+
+
+def withdraw(klass, filename, associations):
+    s = klass(filename)
+    s.data["suggester"] = suggester(associations)
+    s.written = 0
+    start = time.time()
+    # The settings withdraw-cli changes in one run.
+    s["last_date"] = datetime.date.today()
+    s["last_withdrawal_account"] = "Assets:Checking"
+    s["last_deposit_account"] = "Assets:Cash"
+    s.flush()
+    return s.written, time.time() - start
+
+
+def main(argv):
+    associations = int(argv[1]) if len(argv) > 1 else 100000
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "ledgerhelpers.ini")
+        for name, klass in (
+            ("previous Settings", PreviousSettings),
+            ("Settings", CountingSettings),
+        ):
+            written, elapsed = withdraw(klass, filename, associations)
+            print("%-18s %9d bytes written in %.3f seconds" % (
+                name + ":", written, elapsed
+            ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
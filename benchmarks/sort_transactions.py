@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+"""Times sorttrans-cli's sort_transactions against the implementation it
+replaced, on a synthetic journal of about 500000 tokens where every few
+transactions are followed by a block of price directives.
+
+Run with PYTHONPATH=src python3 benchmarks/sort_transactions.py [tokens]
+"""
+
+import collections
+import datetime
+import itertools
+import sys
+import time
+
+from ledgerhelpers import parser
+from ledgerhelpers.programs.sorttranscli import sort_transactions
+
+
+def previous_sort_transactions(items):
+    smallest_date = datetime.date(1000, 1, 1)
+    largest_date = datetime.date(3000, 1, 1)
+    bydates = collections.OrderedDict()
+    first_transaction_seen = False
+    for n, item in enumerate(items):
+        if hasattr(item, "date"):
+            first_transaction_seen = True
+        if first_transaction_seen:
+            later_dates = itertools.chain(
+                (getattr(items[i], "date", None) for i in range(n, len(items))),
+                [largest_date]
+            )
+            for date in later_dates:
+                if date is not None:
+                    break
+        else:
+            date = smallest_date
+        if date not in bydates:
+            bydates[date] = []
+        bydates[date] += [item]
+    for date in sorted(bydates):
+        for item in bydates[date]:
+            yield item
+
+
+def generate_journal(tokens):
+    """Returns a journal that lexes to about the given number of tokens.
+    Each block holds ten transactions in reverse date order and a
+    hundred price directives, which lex to 220 tokens."""
+    blocks = []
+    for n in range(tokens // 220 + 1):
+        day = datetime.date(2000, 1, 1) + datetime.timedelta(n)
+        blocks.append("".join(
+            "%s payee %d\n    Assets:Cash  -1 USD\n    Expenses:Things\n" % (
+                day + datetime.timedelta(10 - m), m
+            )
+            for m in range(10)
+        ))
+        blocks.append("P %s USD 1 CHF\n" % day * 100)
+    return "".join(blocks)
+
+
+def timed(f, items):
+    start = time.time()
+    result = list(f(items))
+    return result, time.time() - start
+
+
+def main(argv):
+    tokens = int(argv[1]) if len(argv) > 1 else 500000
+    items = parser.lex_ledger_file_contents(generate_journal(tokens))
+    print("%d tokens" % len(items))
+    result, elapsed = timed(sort_transactions, items)
+    print("sort_transactions:          %.3f seconds" % elapsed)
+    expected, elapsed = timed(previous_sort_transactions, items)
+    print("previous sort_transactions: %.3f seconds" % elapsed)
+    assert [id(x) for x in result] == [id(x) for x in expected]
+
+
+if __name__ == "__main__":
+    main(sys.argv)
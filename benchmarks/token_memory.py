@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+
+"""Measures the memory taken by the token objects of a synthetic journal,
+and compares it with the same tokens stored in objects with a __dict__,
+as the parser used to store them.
+
+Run with PYTHONPATH=src python3 benchmarks/token_memory.py [transactions]
+"""
+
+import sys
+import tracemalloc
+
+from ledgerhelpers import parser
+
+
+def generate_journal(transactions):
+    return "".join(
+        "2015-01-%02d payee %d\n"
+        "    Assets:Cash    -%d.00 USD\n"
+        "    Expenses:Things\n"
+        "\n" % (n % 28 + 1, n, n)
+        for n in range(transactions)
+    )
+
+
+def attributes(token):
+    for klass in type(token).__mro__:
+        for slot in getattr(klass, "__slots__", ()):
+            if hasattr(token, slot):
+                yield slot, getattr(token, slot)
+
+
+def copy_tokens(tokens, with_dict):
+    """Copies the tokens into new objects with the same attributes, set in
+    the same order.  The copies share the attribute values, so measuring
+    them measures the objects alone."""
+    classes = {}
+    copies = []
+    for token in tokens:
+        klass = type(token)
+        if with_dict:
+            if klass not in classes:
+                classes[klass] = type(klass.__name__, (object,), {})
+            copy = classes[klass]()
+        else:
+            copy = klass.__new__(klass)
+        for name, value in attributes(token):
+            setattr(copy, name, value)
+        copies.append(copy)
+    return copies
+
+
+def measure(tokens, with_dict):
+    tracemalloc.start()
+    try:
+        copies = copy_tokens(tokens, with_dict)
+        return tracemalloc.get_traced_memory()[0] / len(copies)
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv):
+    transactions = int(argv[1]) if len(argv) > 1 else 100000
+    tokens = parser.lex_ledger_file_contents(generate_journal(transactions))
+    print("%d transactions, %d tokens" % (transactions, len(tokens)))
+    print("objects with __dict__:  %6.1f bytes per token" % (
+        measure(tokens, True)
+    ))
+    print("objects with __slots__: %6.1f bytes per token" % (
+        measure(tokens, False)
+    ))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
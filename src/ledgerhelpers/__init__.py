@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import atexit
 import pickle
 import calendar
 import codecs
@@ -8,15 +9,18 @@ import datetime
 import fcntl
 import fnmatch
 import logging
+import math
 import re
 import os
 import signal
 import struct
 import sys
+import tempfile
 import termios
 import threading
 import time
 import tty
+import zlib
 
 __version__ = "0.3.10"
 
@@ -153,17 +157,35 @@ def generate_price_records(records):
 
 
 class Settings(dict):
+    """Settings persisted to a file.
+
+    Setting or deleting an item only marks the settings dirty, and the
+    file is written by flush(), which also runs when the program exits.
+    persist() writes the file right away, even if not dirty, for callers
+    that modified mutable values in place.  The file is replaced
+    atomically, so a crash never leaves it half written, and holds a
+    compressed pickle.  Uncompressed files written by earlier versions
+    load as well."""
 
     def __init__(self, filename):
         self.data = dict()
         self.filename = filename
+        self.dirty = False
+        atexit.register(self.flush)
 
     @classmethod
     def load_or_defaults(cls, filename):
         s = cls(filename)
         if os.path.isfile(s.filename):
             try:
-                s.data = pickle.load(open(s.filename, "rb"))
+                with open(s.filename, "rb") as f:
+                    data = f.read()
+                try:
+                    data = zlib.decompress(data)
+                except zlib.error:
+                    # Written before settings were compressed.
+                    pass
+                s.data = pickle.loads(data)
             except Exception as e:
                 log.error("Cannot load %s so loading defaults: %s", s.filename, e)
         try:
@@ -174,7 +196,7 @@ class Settings(dict):
 
     def __setitem__(self, item, value):
         self.data[item] = value
-        self.persist()
+        self.dirty = True
 
     def __getitem__(self, item):
         return self.data[item]
@@ -182,7 +204,7 @@ class Settings(dict):
     def __delitem__(self, item):
         if item in self.data:
             del self.data[item]
-            self.persist()
+            self.dirty = True
 
     def keys(self):
         return list(self.data.keys())
@@ -190,46 +212,151 @@ class Settings(dict):
     def get(self, item, default):
         return self.data.get(item, default)
 
+    def flush(self):
+        """Writes the settings if they changed since last written."""
+        if self.dirty:
+            self.persist()
+
     def persist(self):
-        p = open(self.filename, "wb")
-        pickle.dump(self.data, p)
-        p.flush()
-        p.close()
+        data = zlib.compress(pickle.dumps(self.data, pickle.HIGHEST_PROTOCOL))
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(prefix=".ledgerhelpers-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmp, self.filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.dirty = False
+
+
+# A minus sign before the first digit of an amount, as in "-1 CHF",
+# "$-1" or "CHF -1".
+RE_NEGATIVE_AMOUNT = re.compile(r"^[^0-9]*-")
 
 
 class AccountSuggester(object):
+    """Suggests accounts for words, from the words associated with each
+    account before, and from the payees of the transactions that post
+    to each account if trained from a journal.
+
+    Only account_to_words is pickled, so suggesters pickled before the
+    inverted index existed load fine, and the index is rebuilt once when
+    a suggester is loaded.  What was learned from the journal is not
+    pickled either, since the journal is there to train from again."""
 
     def __init__(self):
         self.account_to_words = dict()
+        self._index()
 
     def __str__(self):
         dump = str(self.account_to_words)
         return "<AccountSuggester %s>" % dump
 
+    def __getstate__(self):
+        return {"account_to_words": self.account_to_words}
+
+    def __setstate__(self, state):
+        self.account_to_words = state["account_to_words"]
+        self._index()
+
+    def _index(self):
+        # Word -> {account: count}.
+        self.word_to_accounts = dict()
+        # Account -> order of its first association, which breaks ties.
+        self.account_order = dict()
+        # Lexed tokens of the journal trained from.
+        self.journal_tokens = []
+        for account, ws in self.account_to_words.items():
+            for w, c in ws.items():
+                self._count(w, account, c)
+
+    def _count(self, word, account, count):
+        if account not in self.account_order:
+            self.account_order[account] = len(self.account_order)
+        if word not in self.word_to_accounts:
+            self.word_to_accounts[word] = dict()
+        accounts = self.word_to_accounts[word]
+        accounts[account] = accounts.get(account, 0) + count
+        if not accounts[account]:
+            del accounts[account]
+            if not accounts:
+                del self.word_to_accounts[word]
+
     def associate(self, words, account):
         words = [ w.lower() for w in words.split() ]
         account = str(account)
         if account not in self.account_to_words:
             self.account_to_words[account] = dict()
+        ws = self.account_to_words[account]
         for w in words:
-            if w not in self.account_to_words[account]:
-                self.account_to_words[account][w] = 0
-            self.account_to_words[account][w] += 1
-
-    def suggest(self, words):
-        words = [ w.lower() for w in words.split() ]
+            if w not in ws:
+                ws[w] = 0
+            ws[w] += 1
+            self._count(w, account, 1)
+
+    def train_from_journal(self, tokens):
+        """Associates the words of the payee of every transaction among
+        the lexed tokens with the accounts of the postings that money
+        goes to, the ones with positive amounts.  The postings that
+        money comes from, with negative amounts or with the amount left
+        for ledger to balance, most often post to the same asset account
+        whatever the payee, which would then be suggested for all.  If a
+        transaction has no posting with a positive amount, all its
+        postings are associated.
+
+        tokens is the result of lexing the journal, as returned by
+        Journal.internal_parsing().  If the suggester was trained from
+        an earlier lexing of the same journal, only the transactions
+        lexed again are learned, and those lexed before are forgotten."""
+        from ledgerhelpers import parser
+        old = self.journal_tokens
+        n = parser.shared_token_count(old, tokens)
+        counts = collections.Counter()
+        for sign, transactions in ((-1, old[n:]), (1, tokens[n:])):
+            for t in transactions:
+                if not isinstance(t, parser.TokenTransaction):
+                    continue
+                words = [ w.lower() for w in t.payee.split() ]
+                postings = [
+                    p for p in t.postings
+                    if p.amount and not RE_NEGATIVE_AMOUNT.match(p.amount)
+                ] or t.postings
+                for p in postings:
+                    for w in words:
+                        counts[(w, p.account)] += sign
+        for (w, account), c in counts.items():
+            if c:
+                self._count(w, account, c)
+        self.journal_tokens = tokens
+
+    def suggest(self, words, weighted=False):
+        """Returns the account whose words were associated most often
+        with the words, or None if no account was.
+
+        If weighted is True, the associations of words associated with
+        many accounts count less (like TF-IDF), so that words such as
+        "the" do not decide the suggestion."""
         account_counts = dict()
-        for account, ws in list(self.account_to_words.items()):
-            for w, c in list(ws.items()):
-                if w in words:
-                    if not account in account_counts:
-                        account_counts[account] = 0
-                    account_counts[account] += c
-        results = list(reversed(sorted(
-            list(account_counts.items()), key=lambda x: x[1]
-        )))
-        if results:
-            return results[0][0]
+        for w in set(w.lower() for w in words.split()):
+            accounts = self.word_to_accounts.get(w)
+            if not accounts:
+                continue
+            weight = 1
+            if weighted:
+                weight = math.log(
+                    (1 + len(self.account_order)) / (1 + len(accounts))
+                ) + 1
+            for account, c in accounts.items():
+                if not account in account_counts:
+                    account_counts[account] = 0
+                account_counts[account] += c * weight
+        if account_counts:
+            return max(
+                account_counts,
+                key=lambda a: (account_counts[a], self.account_order[a]),
+            )
         return None
 
 
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+"""Per-user daemon that keeps journals parsed by ledger, so that the
+programs do not each parse the journal when they start.
+
+The daemon listens on a UNIX socket in a directory only its user can
+access, and answers the same commands as the slave process that
+Journal starts otherwise.  It watches the journal files and reparses
+them as soon as they change, so that programs rarely wait for
+ledger."""
+
+import logging
+import os
+import stat
+import tempfile
+import threading
+from multiprocessing.connection import Client, Listener
+
+from ledgerhelpers import watching
+
+
+CMD_OPEN = "open"
+# Version of the messages that Journal and JournalParser exchange.
+# Programs only use a daemon that speaks the same version.
+PROTOCOL_VERSION = 3
+POLL_INTERVAL = 1.0
+
+log = logging.getLogger(__name__)
+
+
+class DaemonAlreadyRunning(Exception):
+    pass
+
+
+class ProtocolMismatch(OSError):
+    """The daemon speaks another version of the protocol, as when it was
+    started from another version of ledgerhelpers."""
+
+
+def _fallback_runtime_dir():
+    return os.path.join(tempfile.gettempdir(),
+                        "ledgerhelpers-%d" % os.getuid())
+
+
+def default_address():
+    """Returns the path of the socket of the daemon of the current user,
+    within the XDG runtime directory."""
+    base = os.environ.get("XDG_RUNTIME_DIR") or _fallback_runtime_dir()
+    return os.path.join(base, "ledgerhelpers", "journal.sock")
+
+
+def _private_directories(address):
+    """Returns the directories, outermost first, that the daemon creates
+    for the socket at address.  Outside the XDG runtime directory these
+    include the one in the shared temporary directory, which anybody
+    could have created before the daemon did."""
+    directory = os.path.dirname(address)
+    if os.path.dirname(directory) == _fallback_runtime_dir():
+        return [os.path.dirname(directory), directory]
+    return [directory]
+
+
+def _check_private(path, kind, mode_mask=0o077):
+    s = os.lstat(path)
+    if (not kind(s.st_mode) or s.st_uid != os.getuid() or
+            s.st_mode & mode_mask):
+        raise PermissionError(
+            "%s must belong to you and be accessible only by you" % path
+        )
+
+
+def _check_address(address):
+    """Raises PermissionError unless the socket at address, and the
+    directories the daemon created for it, belong to the current user
+    and nobody else can access them.  Otherwise another user could
+    answer in place of the daemon."""
+    for directory in _private_directories(address):
+        _check_private(directory, stat.S_ISDIR)
+    # The mode of the socket follows the umask, but only the user can
+    # reach it through its directory.
+    _check_private(address, stat.S_ISSOCK, mode_mask=0)
+
+
+def connect(address, path, price_path):
+    """Returns a connection to the daemon listening at address, ready to
+    take commands about the journal at path with prices at price_path.
+    Raises OSError if no daemon listens there, or ProtocolMismatch if
+    the one that does speaks another version of the protocol, or
+    PermissionError if somebody else could have created the socket."""
+    _check_address(address)
+    conn = Client(address, family="AF_UNIX")
+    try:
+        conn.send((CMD_OPEN, PROTOCOL_VERSION, path, price_path))
+        try:
+            result = conn.recv()
+        except EOFError:
+            # Daemons from before the protocol was versioned hang up.
+            raise ProtocolMismatch(
+                "The daemon at %s does not speak protocol version %d" % (
+                    address, PROTOCOL_VERSION
+                )
+            )
+        if isinstance(result, BaseException):
+            raise result
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+
+class JournalDaemon(object):
+
+    logger = logging.getLogger("journal.daemon")
+
+    def __init__(self, address, poll_interval=POLL_INTERVAL):
+        self.address = address
+        self.poll_interval = poll_interval
+        self.listener = None
+        self.closed = False
+        # (path, price path) -> JournalParser.
+        self.parsers = dict()
+        self.parsers_lock = threading.Lock()
+
+    def listen(self):
+        """Creates the socket.  Raises DaemonAlreadyRunning if another
+        daemon listens at the address."""
+        directories = _private_directories(self.address)
+        os.makedirs(os.path.dirname(directories[0]), exist_ok=True)
+        for directory in directories:
+            try:
+                os.mkdir(directory, 0o700)
+            except FileExistsError:
+                pass
+            _check_private(directory, stat.S_ISDIR)
+        try:
+            Client(self.address, family="AF_UNIX").close()
+        except OSError:
+            # Nobody listens, so the socket, if any, is stale.
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+        else:
+            raise DaemonAlreadyRunning(
+                "A ledgerhelpers daemon already listens at %s" % self.address
+            )
+        self.listener = Listener(self.address, family="AF_UNIX")
+
+    def close(self):
+        """Stops listening, so serve_forever() returns."""
+        self.closed = True
+        self.listener.close()
+
+    def _parser(self, path, price_path):
+        from ledgerhelpers import journal
+        with self.parsers_lock:
+            if (path, price_path) not in self.parsers:
+                self.parsers[(path, price_path)] = journal.JournalParser(
+                    path, price_path
+                )
+            return self.parsers[(path, price_path)]
+
+    def serve_forever(self):
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.name = "Journal watcher"
+        watcher.start()
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                if self.closed:
+                    return
+                raise
+            server = threading.Thread(
+                target=self._serve, args=(conn,), daemon=True
+            )
+            server.name = "Journal server"
+            server.start()
+
+    def _serve(self, conn):
+        logger = logging.getLogger("journal.daemon.loop")
+        try:
+            msg = conn.recv()
+            if msg[:2] != (CMD_OPEN, PROTOCOL_VERSION) or len(msg) != 4:
+                conn.send(ProtocolMismatch(
+                    "This daemon speaks protocol version %d" % PROTOCOL_VERSION
+                ))
+                return
+            _, _, path, price_path = msg
+            parser = self._parser(path, price_path)
+            conn.send(None)
+            while True:
+                cmd_args = conn.recv()
+                # Clients that accept stale data are answered while
+                # others wait for ledger to parse the journal.
+                try:
+                    result = parser.service(cmd_args, logger)
+                except Exception as e:
+                    logger.exception("Error servicing %s.", path)
+                    result = e
+                conn.send(result)
+        except EOFError:
+            pass
+        except Exception:
+            logger.exception("Unrecoverable error in connection.")
+        finally:
+            conn.close()
+
+    def _watch(self):
+        while True:
+            with self.parsers_lock:
+                parsers = list(self.parsers.values())
+            # Parsers opened meanwhile are watched after the timeout.
+            try:
+                watching.wait(
+                    [p.watcher for p in parsers if p.watcher is not None],
+                    self.poll_interval,
+                )
+            except (OSError, ValueError):
+                # A parser replaced its watcher, as journals that
+                # include other files do, while it was waited on.
+                pass
+            for parser in parsers:
+                # Only starts parsing.  Errors are answered to clients.
+                try:
+                    parser.reparse_all_if_needed()
+                except Exception:
+                    self.logger.exception("Cannot reparse %s.", parser.path)
@@ -11,6 +11,7 @@ from gi.repository import Gtk
 import ledgerhelpers as h
 import ledgerhelpers.legacy_needsledger as hln
 from ledgerhelpers import gui
+from ledgerhelpers import matching
 from ledgerhelpers.dateentry import DateEntry
 from ledgerhelpers.transactionstatebutton import TransactionStateButton
 
@@ -104,8 +105,8 @@ editabletransactionview button {
         self.attach(lines_evbox, 0, row, 1, 1)
 
         self.lines = []
-        self.accounts_for_completion = Gtk.ListStore(GObject.TYPE_STRING)
-        self.payees_for_completion = Gtk.ListStore(GObject.TYPE_STRING)
+        self.accounts_for_completion = matching.Completer()
+        self.payees_for_completion = matching.Completer()
         self.add_line()
 
         for x in container_evbox, lines_evbox:
@@ -143,16 +144,22 @@ editabletransactionview button {
         self.when.set_date(date)
 
     def set_accounts_for_completion(self, account_list):
-        accounts = Gtk.ListStore(GObject.TYPE_STRING)
-        [accounts.append((str(a),)) for a in account_list]
+        """account_list is a list of accounts or a matching.Completer."""
+        accounts = account_list
+        if not isinstance(accounts, matching.Completer):
+            accounts = matching.Completer()
+            [accounts.add(str(a)) for a in account_list]
         for account, unused_amount in self.lines:
-            account.get_completion().set_model(accounts)
+            account.get_completion().set_completer(accounts)
         self.accounts_for_completion = accounts
 
     def set_payees_for_completion(self, payees_list):
-        payees = Gtk.ListStore(GObject.TYPE_STRING)
-        [payees.append((a,)) for a in payees_list]
-        self.payee.get_completion().set_model(payees)
+        """payees_list is a list of payees or a matching.Completer."""
+        payees = payees_list
+        if not isinstance(payees, matching.Completer):
+            payees = matching.Completer()
+            [payees.add(a) for a in payees_list]
+        self.payee.get_completion().set_completer(payees)
         self.payees_for_completion = payees
 
     def handle_data_changes(self, widget, unused_eventfocus):
@@ -290,7 +297,7 @@ editabletransactionview button {
         account.set_hexpand(True)
         account.set_width_chars(40)
         account.set_activates_default(True)
-        account.get_completion().set_model(self.accounts_for_completion)
+        account.get_completion().set_completer(self.accounts_for_completion)
         account.set_placeholder_text(
             "Account (type for completion)"
         )
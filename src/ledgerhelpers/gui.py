@@ -69,7 +69,14 @@ def cannot_start_dialog(msg):
 
 
 class EagerCompletion(Gtk.EntryCompletion):
-    """Completion class that substring matches within a builtin ListStore."""
+    """Completion class that substring matches within a builtin ListStore.
+
+    If a matching.Completer is set with set_completer(), the matches are
+    computed by the completer instead, once per change of the entry, and
+    the ListStore only ever holds the best ranked matches."""
+
+    completer = None
+    limit = 200
 
     def __init__(self, *args):
         Gtk.EntryCompletion.__init__(self, *args)
@@ -79,16 +86,37 @@ class EagerCompletion(Gtk.EntryCompletion):
         self.set_inline_completion(True)
 
     def iter_points_to_matching_entry(self, unused_c, k, i, unused=None):
+        if self.completer is not None:
+            # The model only holds matches.
+            return True
         model = self.get_model()
         acc = model.get(i, 0)[0].lower()
         if k.lower() in acc:
             return True
         return False
 
+    def set_completer(self, completer):
+        self.completer = completer
+        entry = self.get_entry()
+        self.update_matches(entry.get_text() if entry else "")
+
+    def update_matches(self, key):
+        if self.completer is None:
+            return
+        model = Gtk.ListStore(GObject.TYPE_STRING)
+        for match in self.completer.complete(key, self.limit):
+            model.append((match,))
+        self.set_model(model)
+
 
 def load_journal_and_settings_for_gui(price_file_mandatory=False,
                                       ledger_file=None,
-                                      price_file=None):
+                                      price_file=None,
+                                      token_cache_dir=None,
+                                      lexer_processes=1,
+                                      memory_map=False,
+                                      daemon_address=None,
+                                      accept_stale=False):
     try:
         ledger_file = ledgerhelpers.find_ledger_file(ledger_file)
     except Exception as e:
@@ -107,7 +135,15 @@ def load_journal_and_settings_for_gui(price_file_mandatory=False,
         sys.exit(4)
     try:
         from ledgerhelpers.journal import Journal
-        journal = Journal.from_file(ledger_file, price_file)
+        journal = Journal.from_file(ledger_file, price_file,
+                                    token_cache_dir=token_cache_dir,
+                                    lexer_processes=lexer_processes,
+                                    memory_map=memory_map,
+                                    daemon_address=daemon_address,
+                                    accept_stale=accept_stale,
+                                    # Slaves must not be forked from the
+                                    # threads of the GUI.
+                                    fork_server=True)
     except Exception as e:
         cannot_start_dialog("Cannot open ledger file: %s" % e)
         sys.exit(5)
@@ -137,8 +173,20 @@ class EagerCompletingEntry(Gtk.Entry):
         Gtk.Entry.__init__(self, *args)
         self.default_text = ''
         self.old_default_text = ''
+        # Handlers run in the order they were connected, so the matches
+        # are updated before the completion filters them.
+        self.connect("changed", self.update_completion_matches)
         self.set_completion(EagerCompletion())
 
+    def update_completion_matches(self, unused_w=None):
+        text = self.get_text()
+        bounds = self.get_selection_bounds()
+        if bounds and bounds[1] == len(text):
+            # Inline completion selects the text it inserted, which the
+            # user did not type.
+            text = text[:bounds[0]]
+        self.get_completion().update_matches(text)
+
     def set_default_text(self, default_text):
         self.old_default_text = self.default_text
         self.default_text = default_text
@@ -1,13 +1,17 @@
 #!/usr/bin/python3
 
-import collections
-import errno
+import glob
+import hashlib
 import ledger
-from ledgerhelpers import parser, debug_time
+from ledgerhelpers import daemon, matching, parser, tokencache, debug_time
+from ledgerhelpers import watching
 import ledgerhelpers.legacy_needsledger as hln
 import logging
-from multiprocessing import Process, Pipe
+import mmap
+import multiprocessing
+from multiprocessing import Pipe, connection
 import os
+import re
 import threading
 import time
 
@@ -17,6 +21,44 @@ UNCONDITIONAL = "unconditional"
 IFCHANGED = "ifchanged"
 
 CMD_GET_A_LCFA_C = "get_accounts_last_commodity_for_account_and_commodities"
+CMD_GET_PAYEES = "get_payees"
+CMD_GET_TRANSACTIONS_WITH_PAYEE = "get_transactions_with_payee"
+# Followed by a list of commands, answered with the list of their replies.
+CMD_BATCH = "batch"
+
+# CMD_GET_A_LCFA_C is followed by UNCONDITIONAL and None, or by IFCHANGED
+# and the generation the client has, and then by whether the client accepts
+# stale data, that is, the data harvested before the files changed while
+# they are parsed again.  Replies other than UNCHANGED start with one of
+# these.  The version of these messages is daemon.PROTOCOL_VERSION.
+#   (FULL, generation, stale, accounts, commodities, last commodity indexes)
+# where the last commodity of accounts[n] is commodities[indexes[n]], and
+#   (DELTA, generation, stale, new accounts, new commodities,
+#    [(account index, commodity index), ...])
+# adds accounts and commodities to those of the generation the client
+# asked about, and sets the last commodity of the accounts that changed.
+FULL = "full"
+DELTA = "delta"
+# How many harvests back clients are sent deltas rather than everything.
+MAX_DELTA_GENERATIONS = 32
+
+RE_INCLUDE = re.compile(r"^include[ \t]+(.*?)[ \t]*$", re.MULTILINE)
+# Lines other than those of transactions, prices, commodity conversions,
+# tags and comments.  They may hold directives that change how ledger
+# reads the transactions after them, such as D, alias, apply, year, or
+# default under commodity, so transactions appended after them are not
+# parsed on their own.
+RE_CONTEXT_DIRECTIVE = re.compile(
+    r"^(?![0-9 \t\n;#%|*]|(?:P|C|tag)[ \t]|$)", re.MULTILINE
+)
+# The tokens that transactions appended to a journal may lex to, and
+# still be parsed on their own.
+APPENDABLE_TOKENS = (
+    parser.TokenWhitespace,
+    parser.TokenComment,
+    parser.TokenTransaction,
+    parser.TokenPrice,
+)
 
 
 def transactions_with_payee(payee,
@@ -37,6 +79,181 @@ def transactions_with_payee(payee,
     return transes
 
 
+# The multiprocessing context slaves are started in, if not the default.
+_slave_context = None
+
+
+def start_fork_server():
+    """Makes slaves start from a fork server, started now, that imported
+    ledger and the main module once.  Slaves then start in milliseconds
+    when they are restarted, and do not inherit the threads and memory
+    of the program.  Does nothing where there is no fork server.
+
+    The fork server imports the main module again, so that module must
+    only run the program under if __name__ == "__main__", as the
+    programs of ledgerhelpers do."""
+    global _slave_context
+    if _slave_context is not None:
+        return
+    try:
+        context = multiprocessing.get_context("forkserver")
+    except ValueError:
+        return
+    from multiprocessing import forkserver
+    context.set_forkserver_preload(["__main__", __name__])
+    forkserver.ensure_running()
+    _slave_context = context
+
+
+def _process_context():
+    """Returns the multiprocessing context to start processes in from a
+    process that runs threads, which must not be forked."""
+    return _slave_context or multiprocessing.get_context("spawn")
+
+
+def harvest_ledger_text(text, stripped):
+    """Parses text with ledger, and returns the accounts of its postings
+    and the commodities they use, both in order of first use, the last
+    commodity of each account, and stripped with the commodities it did
+    not have added.  stripped maps the commodities of amounts to their
+    amount of 1 without annotations.  Commodities returned do not contain
+    any annotations."""
+    journal = ledger.Session().read_journal_from_string(text)
+    accts = dict()
+    commos = dict()
+    amts = dict()
+    stripped = dict(stripped)
+    for xact in journal.xacts():
+        for post in xact.posts():
+            acct = str(post.account)
+            accts[acct] = True
+            commodity = post.amount.commodity
+            key = str(commodity)
+            try:
+                comm = stripped[key]
+            except KeyError:
+                comm = ledger.Amount(1).with_commodity(commodity)
+                comm.commodity = comm.commodity.strip_annotations()
+                comm = stripped[key] = str(comm)
+            commos[acct] = comm
+            amts[comm] = True
+    return list(accts), commos, list(amts), stripped
+
+
+def run_ledger_worker(pipe):
+    """Answers the (text, stripped) pairs sent over pipe with what
+    harvest_ledger_text() returns for them, or with the error it raised.
+    This is what the ledger worker process runs."""
+    while True:
+        try:
+            text, stripped = pipe.recv()
+        except EOFError:
+            return
+        try:
+            result = harvest_ledger_text(text, stripped)
+        except Exception as e:
+            result = e
+        pipe.send(result)
+
+
+class LedgerWorker(object):
+    """Parses texts with ledger in another process.  ledger holds the
+    GIL while it parses, so the threads of the process that answers
+    commands could not answer them meanwhile otherwise."""
+
+    def __init__(self, pipe, process=None):
+        self.pipe = pipe
+        self.process = process
+
+    @classmethod
+    def start(klass):
+        pipe, theirconn = Pipe()
+        try:
+            process = _process_context().Process(
+                target=run_ledger_worker,
+                args=(theirconn,),
+                name="Ledger worker",
+                daemon=True,
+            )
+            process.start()
+        finally:
+            theirconn.close()
+        return klass(pipe, process)
+
+    def harvest(self, text, stripped):
+        """Returns harvest_ledger_text(text, stripped), as computed by
+        the worker."""
+        self.pipe.send((text, stripped))
+        result = self.pipe.recv()
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+def include_path(pattern, including_path):
+    """Returns the absolute file name or glob pattern that an include
+    directive for pattern stands for in the file at including_path."""
+    return os.path.normpath(os.path.join(
+        os.path.dirname(os.path.abspath(including_path)),
+        os.path.expanduser(pattern),
+    ))
+
+
+def resolve_include(pattern, including_path):
+    """Returns the paths of the files that an include directive for the
+    file name or glob pattern includes in the file at including_path."""
+    pattern = include_path(pattern, including_path)
+    if watching.is_glob(pattern):
+        return sorted(glob.glob(pattern))
+    return [pattern]
+
+
+def map_file(path):
+    """Returns a read-only memory map of the file at path."""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def map_digest(m, size):
+    """Returns the SHA-256 digest of the first size bytes of the map."""
+    with memoryview(m) as v:
+        return hashlib.sha256(v[:size]).digest()
+
+
+class MappedFile(object):
+    """A read-only memory map of a file, which is replaced by a larger
+    one when the file grows.  Reading past the end of the file, if the
+    file shrank after it was mapped, raises an error instead of crashing
+    the process with SIGBUS.  So does reading after the map was
+    invalidated."""
+
+    def __init__(self, path, m=None):
+        self.path = path
+        self.map = map_file(path) if m is None else m
+        self.length = len(self.map)
+
+    def replace(self, m):
+        """Reads from the map m of the file from now on.  The previous
+        map is unmapped as soon as no reader uses it."""
+        self.map = m
+        self.length = len(m)
+
+    def invalidate(self):
+        """Makes reads raise an error from now on, as the file changed
+        other than by growing."""
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        # The file may be truncated in place at any time, not only when
+        # it is reparsed, so its size is checked on every read.
+        if min(self.length, self.map.size()) < index.stop:
+            raise IOError("%s shrank after it was read" % self.path)
+        return self.map[index]
+
+
 class Joinable(threading.Thread):
     """A subclass of threading.Thread that catches exception in run(), if any,
     and re-throws it in join()."""
@@ -57,50 +274,184 @@ class Joinable(threading.Thread):
             self.exception = e
 
 
+class LexedFile(object):
+    """The tokens of one file of a journal, with what tells whether the
+    file changed since it was lexed, and whether it only grew."""
+
+    logger = logging.getLogger("journal.files")
+
+    def __init__(self, path):
+        self.path = path
+        self.stat = None
+        self.tokens = []
+        self.length = None
+        self.digest = None
+        self.size = None
+        # The MappedFile the tokens read from, if they do.
+        self.mapped = None
+
+    def update(self, token_cache_dir=None, processes=1, memory_map=False):
+        """Lexes the file again if it changed since it was last lexed.
+        Returns True if it did."""
+        stat = watching.stat_key(self.path)
+        if self.stat is not None and stat == self.stat:
+            return False
+        # Stat before reading, so changes made while reading are
+        # noticed the next time.  It is only recorded once the file was
+        # lexed, so files that could not be are read again next time.
+        with open(self.path, "r") as fo:
+            text = fo.read()
+        self.logger.debug("Read %d characters of %s.", len(text), self.path)
+        self.tokens, appended = self._lex(text, token_cache_dir, processes)
+        self.stat = stat
+        if memory_map:
+            self._share_file(appended)
+        return True
+
+    def _lex(self, text, token_cache_dir, processes):
+        """Lexes the text of the file.  If the text only grew since the
+        previous tokens were lexed, only the appended text is lexed.
+        Returns the tokens, and whether the text only grew."""
+        previous = self.tokens
+        length = self.length
+        self.length = None
+        digest = hashlib.sha256()
+        appended = False
+        if previous and length is not None and len(text) >= length:
+            data = text[:length].encode("utf-8")
+            digest.update(data)
+            appended = digest.digest() == self.digest
+        if appended:
+            self.logger.debug("%s grew by %d characters, lexing only "
+                              "the appended text.", self.path,
+                              len(text) - length)
+            res = parser.lex_appended_ledger_file_contents(
+                previous, text, length, verify=parser.VERIFY_CONTINUITY
+            )
+            size = len(data)
+            data = text[length:].encode("utf-8")
+            digest.update(data)
+            size += len(data)
+        else:
+            res = tokencache.lex_ledger_file_contents(
+                self.path, text, token_cache_dir,
+                processes=processes,
+                verify=parser.VERIFY_CONTINUITY,
+            )
+            data = text.encode("utf-8")
+            digest = hashlib.sha256(data)
+            size = len(data)
+        self.length = len(text)
+        self.digest = digest.digest()
+        self.size = size
+        return res, appended
+
+    def _share_file(self, appended):
+        """Makes the tokens read their contents from a memory map of the
+        file, if the file still holds the text that was lexed.  If the
+        tokens were only appended to, the tokens lexed before keep the
+        MappedFile they read from, which maps the grown file instead."""
+        if not appended and self.mapped is not None:
+            # What the previous tokens read is not in the file any more.
+            self.mapped.invalidate()
+            self.mapped = None
+        try:
+            m = map_file(self.path)
+        except (OSError, ValueError) as e:
+            self.logger.debug("Cannot map %s: %s", self.path, e)
+            return
+        if len(m) < self.size or map_digest(m, self.size) != self.digest:
+            self.logger.debug("%s differs from the lexed text, "
+                              "not mapping it.", self.path)
+            m.close()
+            return
+        if self.mapped is None:
+            self.mapped = MappedFile(self.path, m)
+        else:
+            self.mapped.replace(m)
+        parser.share_buffer(self.tokens, self.mapped)
+
+
 class JournalCommon():
 
     path = None
-    path_mtime = None
     price_path = None
-    price_path_mtime = None
+    # Files included by the journal, as found when it was last read, and
+    # watching.stat_key() of each of them from before it was read.
+    included_paths = ()
+    # The glob patterns the journal includes files with, whose
+    # watching.stat_key() is in included_stats too, so that files that
+    # start matching them are noticed.
+    included_patterns = ()
+    included_stats = None
+    watcher = None
+    watched_paths = None
 
     def changed(self):
-        path_mtime = None
-        price_path_mtime = None
-
-        try:
-            path_mtime = os.stat(self.path).st_mtime
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-        try:
-            if self.price_path is not None:
-                price_path_mtime = os.stat(self.price_path).st_mtime
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-
-        if (
-            path_mtime != self.path_mtime or
-            price_path_mtime != self.price_path_mtime
-        ):
-            self.path_mtime = path_mtime
-            self.price_path_mtime = price_path_mtime
+        included = list(self.included_paths) + list(self.included_patterns)
+        paths = [self.path, self.price_path] + included
+        changed = False
+        if self.watcher is None:
+            self.watcher = watching.watch(paths)
+            self.watched_paths = paths
+        elif paths != self.watched_paths:
+            # The journal includes other files since it was last read.
+            # The new watcher only tells about later changes, so the
+            # included files are compared with how they were read.
+            changed = self.watcher.changed() or any(
+                watching.stat_key(p) != self.included_stats.get(p)
+                for p in included
+            )
+            self.watcher.close()
+            self.watcher = watching.watch(paths)
+            self.watcher.changed()
+            self.watched_paths = paths
+        if self.watcher.changed() or changed:
             self.logger.debug("Files have changed, rereading.")
             return True
         else:
             return False
 
+    def _read_with_includes(self, path, seen, patterns):
+        """Returns the text of the file at path, with its include
+        directives replaced by the text of the files they include.  The
+        paths of those files are appended to seen, and files already in
+        seen are not included again.  The glob patterns of the
+        directives are appended to patterns."""
+        self.included_stats[path] = watching.stat_key(path)
+        with open(path, "r") as fo:
+            text = fo.read()
+
+        def include(m):
+            texts = []
+            pattern = include_path(m.group(1), path)
+            if watching.is_glob(pattern) and pattern not in patterns:
+                patterns.append(pattern)
+                self.included_stats[pattern] = watching.stat_key(pattern)
+            for p in resolve_include(m.group(1), path):
+                if p in seen:
+                    self.logger.debug("Not including %s again.", p)
+                    continue
+                seen.append(p)
+                texts.append(self._read_with_includes(p, seen, patterns))
+            return "\n".join(texts)
+
+        return RE_INCLUDE.sub(include, text)
+
     def _get_text(self, prepend_price_path=False):
         files = []
         if self.price_path and prepend_price_path:
             files.append(self.price_path)
         if self.path:
             files.append(self.path)
-        t = []
-        for f in files:
-            with open(f, "r") as fo:
-                t.append(fo.read())
+        # ledger reads the text from a string, so it cannot tell where
+        # relative includes are.  They are read here instead.
+        seen = [os.path.abspath(f) for f in files]
+        patterns = []
+        self.included_stats = dict()
+        t = [self._read_with_includes(f, seen, patterns) for f in files]
+        self.included_paths = seen[len(files):]
+        self.included_patterns = patterns
         text = "\n".join(t)
         self.logger.debug("Read %d characters of journal%s.", len(text), " and price file" if len(files) > 1 else "")
         return text
@@ -118,38 +469,116 @@ class Journal(JournalCommon):
 
     pipe = None
     slave = None
+    ledger_worker = None
     slave_lock = None
     cache = None
     internal_parsing_cache = None
     internal_parsing_cache_lock = None
+    lexed_files = None
+    payee_index_cache = None
+    suggester = None
+    daemon_address = None
+    # Whether the accounts and commodities harvested before the files
+    # changed are returned while ledger parses the files again.
+    accept_stale = False
+    # Whether slaves are started from a fork server (see
+    # start_fork_server()), which is started with the first slave.
+    fork_server = False
+    token_cache_dir = None
+    lexer_processes = 1
+    memory_map = False
 
     def __init__(self):
         """Do not instantiate directly.  Use class methods."""
         self.cache = {}
         self.internal_parsing_cache = []
+        self.lexed_files = dict()
+        self.payee_index_cache = matching.PayeeIndex()
         self.internal_parsing_cache_lock = threading.Lock()
         self.slave_lock = threading.Lock()
 
-    def _start_slave(self):
+    def _start_slave(self, snapshot=None):
+        """Starts the slave, or connects to the daemon.  A slave is given
+        the snapshot of accounts and commodities, if any, to answer
+        callers that accept stale data until it parsed the journal."""
         if self.pipe:
             self.pipe.close()
-        self.pipe, theirconn = Pipe()
-        if self.slave:
+        for process in (self.slave, self.ledger_worker):
+            if process:
+                try:
+                    process.terminate()
+                except Exception:
+                    pass
+        self.slave = None
+        self.ledger_worker = None
+        if self.daemon_address is not None:
             try:
-                self.slave.terminate()
-            except Exception:
-                pass
+                self.pipe = daemon.connect(
+                    self.daemon_address, self.path, self.price_path
+                )
+                return
+            except OSError as e:
+                self.logger.debug("Journal daemon unavailable, parsing "
+                                  "journal in a slave: %s", e)
+        if self.fork_server:
+            start_fork_server()
+        self.pipe, theirconn = Pipe()
+        # Slaves are daemonic, so they cannot start their ledger worker.
+        workerconn, theirworkerconn = Pipe()
         try:
-            self.slave = JournalSlave(theirconn, self.path, self.price_path)
+            context = _slave_context or multiprocessing.get_context()
+            self.ledger_worker = context.Process(
+                target=run_ledger_worker,
+                args=(theirworkerconn,),
+                name="Ledger worker",
+                daemon=True,
+            )
+            self.ledger_worker.start()
+            self.slave = context.Process(
+                target=run_slave,
+                args=(theirconn, self.path, self.price_path, snapshot,
+                      workerconn),
+                name="Journal slave",
+                daemon=True,
+            )
             self.slave.start()
         finally:
             theirconn.close()
+            workerconn.close()
+            theirworkerconn.close()
 
     @classmethod
-    def from_file(klass, journal_file, price_file):
+    def from_file(klass, journal_file, price_file, token_cache_dir=None,
+                  lexer_processes=1, memory_map=False, suggester=None,
+                  daemon_address=None, accept_stale=False,
+                  fork_server=False):
+        """Opens the journal.  If token_cache_dir is not None, the lexed
+        journal is cached in that directory across runs.  If
+        lexer_processes is not 1, the journal is lexed in parallel by
+        that many processes (see parser.lex_ledger_file_contents).
+        If memory_map is true, the lexed tokens do not keep copies of the
+        journal text, but read it from a memory map of the journal file.
+        If suggester is not None, it is an AccountSuggester trained from
+        the journal every time the journal is lexed.
+        If daemon_address is not None and a ledgerhelpers daemon listens
+        there, ledger parses the journal in the daemon, once for all the
+        programs, instead of in a slave process of this program.
+        If accept_stale is true, accounts and commodities are returned
+        from before the journal changed while ledger parses it again,
+        rather than after waiting for ledger (see stale()).
+        If fork_server is true, slaves are started from a fork server
+        rather than forked from the threads of the program, as GUIs
+        must (see start_fork_server())."""
         j = klass()
         j.path = journal_file
         j.price_path = price_file
+        j.token_cache_dir = token_cache_dir
+        j.lexer_processes = lexer_processes
+        j.memory_map = memory_map
+        j.suggester = suggester
+        j.daemon_address = daemon_address
+        j.accept_stale = accept_stale
+        j.fork_server = fork_server
         j._start_slave()
         j._cache_internal_parsing()
         return j
@@ -159,14 +588,25 @@ class Journal(JournalCommon):
 
         if self.changed():
             me = self
+            previous_payee_index = (
+                self.payee_index_cache or matching.PayeeIndex()
+            )
             self.internal_parsing_cache = None
+            self.payee_index_cache = None
 
             class Rpi(Joinable):
                 @debug_time(self.logger)
                 def __run__(self):
                     try:
                         me.logger.debug("Reparsing internal.")
-                        res = parser.lex_ledger_file_contents(me.get_journal_text())
+                        res = me._lex_journal_files()
+                        # Updating the index only indexes the tokens
+                        # that were lexed again.
+                        me.payee_index_cache = previous_payee_index.updated(
+                            res
+                        )
+                        if me.suggester is not None:
+                            me.suggester.train_from_journal(res)
                         me.internal_parsing_cache = res
                     finally:
                         me.internal_parsing_cache_lock.release()
@@ -181,49 +621,147 @@ class Journal(JournalCommon):
             nothread.start()
             return nothread
 
-    def _cache_accounts_last_commodity_for_account_and_commodities(self):
+    def _lex_journal_files(self):
+        """Returns the tokens of the journal, where the tokens of each
+        file it includes follow the include directive.  Only the files
+        that changed since they were last lexed are lexed again."""
+        lexed_files = dict()
+        # Glob pattern -> watching.stat_key() of it before it was resolved.
+        patterns = dict()
+        tokens = []
+
+        def lex(path):
+            f = self.lexed_files.get(path) or LexedFile(path)
+            f.update(self.token_cache_dir, self.lexer_processes,
+                     self.memory_map)
+            lexed_files[path] = f
+            for token in f.tokens:
+                tokens.append(token)
+                if isinstance(token, parser.TokenInclude):
+                    pattern = include_path(token.path, path)
+                    if watching.is_glob(pattern) and pattern not in patterns:
+                        patterns[pattern] = watching.stat_key(pattern)
+                    for p in resolve_include(token.path, path):
+                        if p not in lexed_files:
+                            lex(p)
+
+        lex(os.path.abspath(self.path))
+        self.lexed_files = lexed_files
+        self.included_paths = list(lexed_files)[1:]
+        self.included_patterns = list(patterns)
+        self.included_stats = dict(
+            (p, f.stat) for p, f in lexed_files.items()
+        )
+        self.included_stats.update(patterns)
+        return tokens
+
+    def _request(self, *commands):
+        """Sends the commands to the slave in one message, and returns the
+        list of its replies.  Must be called with slave_lock held."""
+        if len(commands) == 1:
+            self.pipe.send(commands[0])
+        else:
+            self.pipe.send((CMD_BATCH, commands))
+        result = self.pipe.recv()
+        if isinstance(result, BaseException):
+            raise result
+        return [result] if len(commands) == 1 else result
+
+    def _cache_accounts_last_commodity_for_account_and_commodities(
+        self, accept_stale=None
+    ):
+        if accept_stale is None:
+            accept_stale = self.accept_stale
         with self.slave_lock:
             try:
-                self.pipe.send(
-                    (CMD_GET_A_LCFA_C,
-                     IFCHANGED if "accounts" in self.cache
-                     else UNCONDITIONAL)
-                )
-                result = self.pipe.recv()
-                if isinstance(result, BaseException):
-                    raise result
+                if "accounts" in self.cache:
+                    cmd = (CMD_GET_A_LCFA_C, IFCHANGED,
+                           self.cache["generation"], accept_stale)
+                else:
+                    cmd = (CMD_GET_A_LCFA_C, UNCONDITIONAL, None,
+                           accept_stale)
+                result, = self._request(cmd)
                 if result == UNCHANGED:
                     assert "accounts" in self.cache
-                else:
-                    accounts = result[0] if result[0] is not None else []
-                    last_commodity_for_account = dict(
-                        (acc, ledger.Amount(amt))
-                        for acc, amt in list(result[1].items())
-                    ) if result[1] is not None else {}
-                    all_commodities = [
-                        ledger.Amount(c)
-                        for c in result[2]
-                    ] if result[2] is not None else []
+                    self.cache["stale"] = False
+                elif result[0] == FULL:
+                    _, generation, stale, accounts, commodities, last = result
+                    # Accounts share the amounts of their commodities.
+                    all_commodities = [ledger.Amount(c) for c in commodities]
                     self.cache["accounts"] = accounts
-                    self.cache["last_commodity_for_account"] = (
-                        last_commodity_for_account
+                    self.cache["last_commodity_for_account"] = dict(
+                        zip(accounts, [all_commodities[n] for n in last])
                     )
                     self.cache["all_commodities"] = all_commodities
+                    self.cache["commodity_strings"] = commodities
+                    self.cache["generation"] = generation
+                    self.cache["stale"] = stale
+                else:
+                    assert result[0] == DELTA, result[0]
+                    _, generation, stale, accounts, commodities, changes = (
+                        result
+                    )
+                    # Lists and dicts already returned stay as they were.
+                    accounts = self.cache["accounts"] + accounts
+                    all_commodities = self.cache["all_commodities"] + [
+                        ledger.Amount(c) for c in commodities
+                    ]
+                    commodities = self.cache["commodity_strings"] + commodities
+                    last = dict(self.cache["last_commodity_for_account"])
+                    for a, c in changes:
+                        last[accounts[a]] = all_commodities[c]
+                    self.cache["accounts"] = accounts
+                    self.cache["last_commodity_for_account"] = last
+                    self.cache["all_commodities"] = all_commodities
+                    self.cache["commodity_strings"] = commodities
+                    self.cache["generation"] = generation
+                    self.cache["stale"] = stale
             except BaseException:
+                snapshot = self._snapshot()
                 self.cache = {}
-                self._start_slave()
+                self._start_slave(snapshot)
                 raise
 
+    def _snapshot(self):
+        """Returns the accounts and commodities last received, in the form
+        JournalParser.restore() takes, or None if none were."""
+        if "accounts" not in self.cache:
+            return None
+        accounts = self.cache["accounts"]
+        # Accounts share the amounts of their commodities.
+        positions = dict(
+            (id(a), n) for n, a in enumerate(self.cache["all_commodities"])
+        )
+        last = self.cache["last_commodity_for_account"]
+        return (
+            accounts,
+            self.cache["commodity_strings"],
+            [positions[id(last[a])] for a in accounts],
+        )
+
     @debug_time(logger)
-    def accounts_and_last_commodity_for_account(self):
-        self._cache_accounts_last_commodity_for_account_and_commodities()
+    def accounts_and_last_commodity_for_account(self, accept_stale=None):
+        """Returns the accounts and the last commodity used with each.
+        accept_stale overrides the policy Journal.from_file() was given."""
+        self._cache_accounts_last_commodity_for_account_and_commodities(
+            accept_stale
+        )
         return self.cache["accounts"], self.cache["last_commodity_for_account"]
 
     @debug_time(logger)
-    def commodities(self):
-        self._cache_accounts_last_commodity_for_account_and_commodities()
+    def commodities(self, accept_stale=None):
+        self._cache_accounts_last_commodity_for_account_and_commodities(
+            accept_stale
+        )
         return self.cache["all_commodities"]
 
+    def stale(self):
+        """Returns whether the accounts and commodities last returned are
+        from before the journal changed, because ledger was still parsing
+        it again.  Ask again later, or with accept_stale=False, to have
+        them up to date."""
+        return self.cache.get("stale", False)
+
     def commodity(self, label, create=False):
         pool = ledger.Amount("$ 1").commodity.pool()
         if create:
@@ -234,11 +772,23 @@ class Journal(JournalCommon):
     @debug_time(logger)
     def all_payees(self):
         """Returns a list of strings with payees (transaction titles)."""
-        titles = collections.OrderedDict()
-        for xact in self.internal_parsing():
-            if hasattr(xact, "payee") and xact.payee not in titles:
-                titles[xact.payee] = xact.payee
-        return list(titles.keys())
+        return self.payee_index().all_payees()
+
+    @debug_time(logger)
+    def payee_index(self):
+        """Returns a matching.PayeeIndex of the transactions in the
+        internal parsing."""
+        self._cache_internal_parsing().join()
+        with self.internal_parsing_cache_lock:
+            return self.payee_index_cache
+
+    @debug_time(logger)
+    def account_suggester(self):
+        """Returns the AccountSuggester passed to from_file(), once it
+        has been trained from the journal as it is now."""
+        self._cache_internal_parsing().join()
+        with self.internal_parsing_cache_lock:
+            return self.suggester
 
     @debug_time(logger)
     def internal_parsing(self):
@@ -268,115 +818,398 @@ class Journal(JournalCommon):
         return self._add_text_to_file(text, self.price_path)
 
 
-class JournalSlave(JournalCommon, Process):
+class JournalParser(JournalCommon):
+    """Parses a journal with ledger and answers the commands Journal sends
+    about it, reparsing when its files change.  JournalSlave answers them
+    in a process of each program, and the ledgerhelpers daemon in one
+    process that all programs share."""
 
-    session = None
-    journal = None
+    # Parses the journal, lazily started unless given to __init__.
+    ledger_worker = None
     accounts = None
     last_commodity_for_account = None
     all_commodities = None
+    # Generation of the accounts and commodities harvested, which is an
+    # earlier one while the files are parsed again.  harvest_lock guards
+    # them and all the caches of what was harvested.
+    harvested_generation = None
+    harvest_lock = None
+    # Account -> index in accounts, and commodity -> index in
+    # all_commodities.
+    account_positions = None
+    commodity_positions = None
+    # (generation, number of accounts and of commodities before it,
+    # accounts that were added or changed last commodity) of every
+    # harvest since generation changes_since, from which deltas are made.
+    changes = ()
+    changes_since = None
+    # Commodity -> its amount of 1 stripped of annotations, as harvested.
+    stripped_commodities = None
+    payee_index = None
+    # Length and digest of the text ledger parsed last, and whether it
+    # has directives that RE_CONTEXT_DIRECTIVE matches.
+    ledger_text_length = None
+    ledger_text_digest = None
+    ledger_text_has_context = False
+    # Incremented every time the files change, so clients can tell
+    # whether what they were answered before is still current.
+    generation = 0
+    ledger_parsing_thread = None
+    # Guards generation and ledger_parsing_thread, so that threads may
+    # service commands at once.
+    reparse_lock = None
     logger = logging.getLogger("journal.slave")
 
-    def __init__(self, pipe, path, price_path):
-        Process.__init__(self)
-        self.daemon = True
-        self.pipe = pipe
+    def __init__(self, path, price_path, ledger_worker=None):
         self.path = path
         self.price_path = price_path
+        self.ledger_worker = ledger_worker
+        self.harvest_lock = threading.Lock()
+        self.reparse_lock = threading.Lock()
         self.clear_caches()
 
     def clear_caches(self):
-        self.session = None
-        self.journal = None
         self.accounts = None
         self.last_commodity_for_account = None
         self.all_commodities = None
+        self.harvested_generation = None
+        self.account_positions = None
+        self.commodity_positions = None
+        self.changes = []
+        self.changes_since = None
+        self.stripped_commodities = None
+        self.payee_index = None
+        self.ledger_text_length = None
 
-    def reparse_ledger(self):
-        self.logger.debug("Reparsing ledger.")
-        session = ledger.Session()
-        journal = session.read_journal_from_string(self.get_journal_text_with_prices())
-        self.session = session
-        self.journal = journal
+    def _ledger_worker(self):
+        if self.ledger_worker is None:
+            self.ledger_worker = LedgerWorker.start()
+        return self.ledger_worker
 
-    def harvest_accounts_and_last_commodities(self):
+    def harvest_accounts_and_last_commodities(self, text=None,
+                                              appended=False,
+                                              generation=None):
+        """Parses text, or the journal and price files if None, with
+        ledger and harvests the accounts and commodities of its postings.
+        If appended, text holds transactions appended to the text
+        harvested before, and what they use is added to what was
+        harvested before.  What is harvested belongs to generation, the
+        current one if None, which must be the generation the journal
+        had when text was to be read."""
         self.logger.debug("Harvesting accounts and last commodities.")
-        # Commodities returned by this method do not contain any annotations.
-        accts = []
-        commos = dict()
-        amts = dict()
-        for post in self.journal.query(""):
-            for subpost in post.xact.posts():
-                if str(subpost.account) not in accts:
-                    accts.append(str(subpost.account))
-                comm = ledger.Amount(1).with_commodity(subpost.amount.commodity)
-                comm.commodity = comm.commodity.strip_annotations()
-                commos[str(subpost.account)] = str(comm)
-                amts[str(comm)] = True
-        self.accounts = accts
-        self.last_commodity_for_account = commos
-        self.all_commodities = [str(k) for k in list(amts.keys())]
+        if generation is None:
+            generation = self.generation
+        if text is None:
+            text = self.get_journal_text_with_prices()
+        # Known commodities keep the precision the whole journal gave
+        # them.
+        accounts, last, commodities, stripped = self._ledger_worker().harvest(
+            text, self.stripped_commodities if appended else dict()
+        )
+        if appended:
+            touched = set(accounts)
+            # Dicts keep accounts and commodities in order of first use.
+            accounts = list(dict.fromkeys(self.accounts + accounts))
+            last, appended_last = dict(self.last_commodity_for_account), last
+            last.update(appended_last)
+            commodities = list(
+                dict.fromkeys(self.all_commodities + commodities)
+            )
+        else:
+            touched = None
+        with self.harvest_lock:
+            previous = (
+                self.accounts,
+                self.all_commodities,
+                self.last_commodity_for_account,
+            )
+            self.accounts = accounts
+            self.last_commodity_for_account = last
+            self.all_commodities = commodities
+            self.stripped_commodities = stripped
+            self._record_changes(previous, touched, generation)
+            self.harvested_generation = generation
+
+    def _record_changes(self, previous, touched, generation):
+        """Records what changed in generation since the accounts,
+        commodities and last commodities harvested before, if accounts
+        and commodities were only added.  touched is the accounts that
+        may have changed, or None if any may have."""
+        accounts, commodities, last = previous
+        if touched is None and (
+            accounts is None or
+            self.accounts[:len(accounts)] != accounts or
+            self.all_commodities[:len(commodities)] != commodities
+        ):
+            self.account_positions = dict(
+                (a, n) for n, a in enumerate(self.accounts)
+            )
+            self.commodity_positions = dict(
+                (c, n) for n, c in enumerate(self.all_commodities)
+            )
+            self.changes = []
+            self.changes_since = generation
+            return
+        for a in self.accounts[len(accounts):]:
+            self.account_positions[a] = len(self.account_positions)
+        for c in self.all_commodities[len(commodities):]:
+            self.commodity_positions[c] = len(self.commodity_positions)
+        if touched is None:
+            touched = self.accounts
+        current = self.last_commodity_for_account
+        changed = set(a for a in touched if last.get(a) != current[a])
+        self.changes.append(
+            (generation, len(accounts), len(commodities), changed)
+        )
+        if len(self.changes) > MAX_DELTA_GENERATIONS:
+            self.changes_since = self.changes.pop(0)[0]
+
+    def restore(self, snapshot):
+        """Takes the accounts, commodities and last commodity indexes of
+        the snapshot, taken from another parser of the journal, as
+        harvested, so they are answered as stale until the journal is
+        parsed."""
+        accounts, commodities, last = snapshot
+        with self.harvest_lock:
+            self.accounts = list(accounts)
+            self.all_commodities = list(commodities)
+            self.last_commodity_for_account = dict(
+                zip(accounts, [commodities[n] for n in last])
+            )
+            self._record_changes((None, None, None), None, self.generation)
+            self.harvested_generation = self.generation
+
+    def _accounts_and_commodities_reply(self, generation=None):
+        """Returns the reply to CMD_GET_A_LCFA_C for a client that was
+        sent the accounts and commodities of generation before, if any.
+        Must be called with harvest_lock held."""
+        positions = self.commodity_positions
+        stale = self.harvested_generation != self.generation
+        if (
+            generation is None or
+            self.changes_since is None or
+            generation < self.changes_since
+        ):
+            current = self.last_commodity_for_account
+            return (
+                FULL,
+                self.harvested_generation,
+                stale,
+                self.accounts,
+                self.all_commodities,
+                [positions[current[a]] for a in self.accounts],
+            )
+        changes = [c for c in self.changes if c[0] > generation]
+        if changes:
+            _, accounts, commodities, _ = changes[0]
+        else:
+            accounts, commodities = len(self.accounts), len(self.all_commodities)
+        changed = set().union(*(c[3] for c in changes))
+        current = self.last_commodity_for_account
+        return (
+            DELTA,
+            self.harvested_generation,
+            stale,
+            self.accounts[accounts:],
+            self.all_commodities[commodities:],
+            sorted(
+                (self.account_positions[a], positions[current[a]])
+                for a in changed
+            ),
+        )
+
+    def _remember_ledger_text(self, text, has_context):
+        self.ledger_text_length = len(text)
+        self.ledger_text_digest = hashlib.sha256(text.encode("utf-8")).digest()
+        self.ledger_text_has_context = has_context
+
+    def harvest_appended_ledger_text(self, text, generation=None):
+        """Parses with ledger only what was appended to the text parsed
+        before, and harvests it as generation, if text is that text with
+        transactions appended.  Returns False if the whole text must be
+        parsed."""
+        length = self.ledger_text_length
+        if (
+            length is None or
+            self.ledger_text_has_context or
+            len(text) < length or
+            not text[:length].endswith("\n")
+        ):
+            return False
+        data = text[:length].encode("utf-8")
+        if hashlib.sha256(data).digest() != self.ledger_text_digest:
+            return False
+        appended = text[length:]
+        try:
+            tokens = parser.lex_ledger_file_contents(appended)
+        except parser.LexingError:
+            return False
+        if not all(isinstance(t, APPENDABLE_TOKENS) for t in tokens):
+            return False
+        self.logger.debug("Parsing %d appended characters.", len(appended))
+        try:
+            self.harvest_accounts_and_last_commodities(
+                appended, True, generation
+            )
+        except RuntimeError as e:
+            self.logger.debug("Cannot parse appended text alone: %s", e)
+            return False
+        self._remember_ledger_text(text, False)
+        return True
+
+    def update_ledger(self, generation=None):
+        """Parses the journal with ledger and harvests its accounts and
+        commodities as generation, the current one if None.  When
+        transactions were only appended to the journal, as the programs
+        that add transactions do, only those are parsed."""
+        text = self.get_journal_text_with_prices()
+        if self.harvest_appended_ledger_text(text, generation):
+            return
+        self.ledger_text_length = None
+        self.harvest_accounts_and_last_commodities(text, False, generation)
+        self._remember_ledger_text(
+            text, RE_CONTEXT_DIRECTIVE.search(text) is not None
+        )
 
     def reparse_all_if_needed(self):
+        with self.reparse_lock:
+            return self._reparse_all_if_needed()
+
+    def _reparse_all_if_needed(self):
         me = self
 
         changed = self.changed()
         if changed:
-            self.clear_caches()
+            previous = self.ledger_parsing_thread
+            # What was harvested is kept, in case the journal was only
+            # appended to.
+            self.payee_index = None
+            self.generation += 1
+            # The journal may change again while it is parsed, and what
+            # is harvested must not pass for the later generation.
+            generation = self.generation
 
             class Rpl(Joinable):
                 @debug_time(self.logger)
                 def __run__(self):
-                    me.reparse_ledger()
-                    me.harvest_accounts_and_last_commodities()
+                    if previous:
+                        # The parse of the previous contents must not
+                        # overwrite the results of this one.  Its errors
+                        # no longer matter.
+                        threading.Thread.join(previous)
+                    me.update_ledger(generation)
 
             ledger_parsing_thread = Rpl()
             ledger_parsing_thread.name = "Ledger reparser"
+            ledger_parsing_thread.start()
+            self.ledger_parsing_thread = ledger_parsing_thread
+
+        elif self.ledger_parsing_thread:
+            # Still parsing, perhaps, so callers must join it too.
+            ledger_parsing_thread = self.ledger_parsing_thread
 
         else:
             ledger_parsing_thread = threading.Thread(target=len, args=([],))
             ledger_parsing_thread.name = "Dummy ledger reparser"
-
-        ledger_parsing_thread.start()
+            ledger_parsing_thread.start()
 
         return (
             changed, ledger_parsing_thread
         )
 
+    def _payee_index(self):
+        if self.payee_index is None:
+            tokens = parser.lex_ledger_file_contents(self.get_journal_text())
+            self.payee_index = matching.PayeeIndex().updated(tokens)
+        return self.payee_index
+
+    def service(self, cmd_args, logger):
+        """Returns the reply to the command, after reparsing the journal
+        if it changed.  Several clients may send commands, so the ones
+        that ask for data only if it changed pass along the generation
+        of the data they were sent before."""
+        cmd = cmd_args[0]
+        start = time.time()
+        logger.debug("* Servicing: %-55s  started", cmd)
+        args = cmd_args[1:]
+        unused_changed, lpt = self.reparse_all_if_needed()
+        if cmd == CMD_GET_A_LCFA_C:
+            generation = args[1] if args[0] == IFCHANGED else None
+            if (
+                generation == self.generation and
+                self.harvested_generation == self.generation
+            ):
+                logger.debug("* Serviced:  %-55s  %.3f seconds - %s",
+                             cmd, time.time() - start, UNCHANGED)
+                return UNCHANGED
+            accept_stale = args[2]
+            # Callers that accept stale data get it even if parsing
+            # failed, and the others get the error.
+            if not accept_stale or self.harvested_generation is None:
+                lpt.join()
+            with self.harvest_lock:
+                logger.debug("* Serviced:  %-55s  %.3f seconds - %s data",
+                             cmd, time.time() - start,
+                             "stale" if self.harvested_generation !=
+                             self.generation else "new")
+                return self._accounts_and_commodities_reply(generation)
+        elif cmd == CMD_BATCH:
+            return [self.service(c, logger) for c in args[0]]
+        elif cmd == CMD_GET_PAYEES:
+            return self._payee_index().all_payees()
+        elif cmd == CMD_GET_TRANSACTIONS_WITH_PAYEE:
+            return [
+                t.contents
+                for t in self._payee_index().transactions_with_payee(*args)
+            ]
+        else:
+            assert 0, "not reached"
+
+
+def run_slave(pipe, path, price_path, snapshot=None, ledger_pipe=None):
+    """Answers the commands that Journal sends over pipe, parsing the
+    journal with the ledger worker at the other end of ledger_pipe.  This
+    is what the slave process runs."""
+    ledger_worker = LedgerWorker(ledger_pipe) if ledger_pipe else None
+    JournalSlave(pipe, path, price_path, snapshot, ledger_worker).run()
+
+
+class JournalSlave(JournalParser):
+
+    def __init__(self, pipe, path, price_path, snapshot=None,
+                 ledger_worker=None):
+        JournalParser.__init__(self, path, price_path, ledger_worker)
+        self.pipe = pipe
+        self.snapshot = snapshot
+
     def run(self):
         logger = logging.getLogger("journal.slave.loop")
+        if self.snapshot is not None:
+            self.restore(self.snapshot)
         _, initial_parsing_thread = self.reparse_all_if_needed()
+        if self.snapshot is not None:
+            # Commands are answered from the snapshot meanwhile.
+            initial_parsing_thread = None
         while True:
-            cmd_args = self.pipe.recv()
+            # The watcher changes when the journal includes other files.
+            waitables = [self.pipe]
+            if hasattr(self.watcher, "fileno"):
+                waitables.append(self.watcher)
+            if self.pipe not in connection.wait(waitables):
+                # The files changed, so reparse them before the next
+                # command asks.
+                self.reparse_all_if_needed()
+                continue
+            try:
+                cmd_args = self.pipe.recv()
+            except EOFError:
+                # The Journal went away.
+                return
             if initial_parsing_thread:
                 initial_parsing_thread.join()
                 initial_parsing_thread = None
-            cmd = cmd_args[0]
-            start = time.time()
-            logger.debug("* Servicing: %-55s  started", cmd)
-            args = cmd_args[1:]
             try:
-                changed, lpt = self.reparse_all_if_needed()
-                if cmd == CMD_GET_A_LCFA_C:
-                    if (
-                        not changed and
-                        args[0] == IFCHANGED and
-                        self.journal
-                    ):
-                        logger.debug("* Serviced:  %-55s  %.3f seconds - %s",
-                                     cmd, time.time() - start, UNCHANGED)
-                        self.pipe.send(UNCHANGED)
-                        continue
-                    lpt.join()
-                    logger.debug("* Serviced:  %-55s  %.3f seconds - new data",
-                                 cmd, time.time() - start)
-                    self.pipe.send((
-                        self.accounts,
-                        self.last_commodity_for_account,
-                        self.all_commodities,
-                    ))
-                else:
-                    assert 0, "not reached"
+                self.pipe.send(self.service(cmd_args, logger))
             except BaseException as e:
                 logger.exception("Unrecoverable error in slave.")
                 self.pipe.send(e)
@@ -4,6 +4,8 @@ import struct
 import termios
 import tty
 
+from ledgerhelpers import matching
+
 
 CURSOR_UP = "\033[F"
 QUIT = "quit"
@@ -66,6 +68,14 @@ def get_terminal_width(fd):
 
 
 def prompt_for_account(fdin, fdout, accounts, prompt, default):
+    """accounts is a list of accounts or a matching.AccountMatcher.
+    Programs that prompt for several accounts should build the matcher
+    once, with matching.account_completer()."""
+    matcher = accounts
+    if not isinstance(matcher, matching.Completer):
+        matcher = matching.AccountMatcher()
+        for account in accounts:
+            matcher.add(str(account))
     cols = get_terminal_width(fdin)
     line = prompt + ("" if not default else " '': %s" % default)
     print_line_ellipsized(fdout, cols, line)
@@ -83,7 +93,7 @@ def prompt_for_account(fdin, fdout, accounts, prompt, default):
         if not inp:
             match = default
         else:
-            matches = [ a for a in accounts if inp.lower() in a.lower() ]
+            matches = matcher.complete(inp, 1)
             match = matches[0] if matches else inp if inp else default
         cols = get_terminal_width(fdin)
         go_cursor_up(fdout)
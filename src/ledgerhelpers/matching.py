@@ -0,0 +1,420 @@
+#!/usr/bin/python3
+
+import bisect
+import heapq
+import itertools
+import operator
+
+from ledgerhelpers import parser
+
+
+def trigrams(text):
+    """Returns the set of substrings of length 3 of text."""
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SubstringIndex(object):
+    """Set of strings that finds the strings containing a substring
+    without testing every string, using an index of their trigrams.
+
+    Strings are matched exactly as given, so callers that want
+    case-insensitive matches should add and search lowercased strings."""
+
+    def __init__(self, strings=()):
+        self.strings = set()
+        self.trigrams = dict()
+        for string in strings:
+            self.add(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def copy(self):
+        c = SubstringIndex()
+        c.strings = set(self.strings)
+        c.trigrams = dict((t, set(s)) for t, s in self.trigrams.items())
+        return c
+
+    def add(self, string):
+        if string in self.strings:
+            return
+        self.strings.add(string)
+        for t in trigrams(string):
+            if t not in self.trigrams:
+                self.trigrams[t] = set()
+            self.trigrams[t].add(string)
+
+    def remove(self, string):
+        if string not in self.strings:
+            return
+        self.strings.remove(string)
+        for t in trigrams(string):
+            self.trigrams[t].discard(string)
+            if not self.trigrams[t]:
+                del self.trigrams[t]
+
+    def search(self, substring):
+        """Returns the set of strings that contain substring."""
+        ts = trigrams(substring)
+        if not ts:
+            # Too short to use the index.
+            return set(s for s in self.strings if substring in s)
+        candidates = None
+        for t in sorted(ts, key=lambda t: len(self.trigrams.get(t, ()))):
+            if t not in self.trigrams:
+                return set()
+            if candidates is None:
+                candidates = set(self.trigrams[t])
+            else:
+                candidates &= self.trigrams[t]
+        return set(s for s in candidates if substring in s)
+
+
+class PayeeIndex(object):
+    """Index of the transactions of a lexed journal by payee.
+
+    An index is never modified once built, so it can be used from any
+    thread.  updated() returns a new index for new tokens, reusing the
+    work done for the tokens the new and old lexing results share."""
+
+    def __init__(self):
+        self.tokens = []
+        # Payee -> number of transactions, in order of first appearance.
+        self.payees = dict()
+        # Payee -> sequence number of its first appearance.
+        self.order = dict()
+        self.next_order = 0
+        # Lowercased payee -> transactions, in journal order.
+        self.transactions = dict()
+        # Lowercased payee -> set of payees.
+        self.spellings = dict()
+        # Lowercased payees.
+        self.substrings = SubstringIndex()
+
+    def updated(self, tokens):
+        """Returns an index of the tokens, which are the result of
+        lexing the journal again."""
+        old = self.tokens
+        n = parser.shared_token_count(old, tokens)
+        if not n and old:
+            return PayeeIndex().updated(tokens)
+        index = PayeeIndex()
+        index.tokens = tokens
+        index.payees = dict(self.payees)
+        index.order = dict(self.order)
+        index.next_order = self.next_order
+        index.transactions = dict(self.transactions)
+        index.spellings = dict(self.spellings)
+        index.substrings = self.substrings
+        index._copied = set()
+        for token in old[n:]:
+            if isinstance(token, parser.TokenTransaction):
+                index._remove(token)
+        for token in tokens[n:]:
+            if isinstance(token, parser.TokenTransaction):
+                index._add(token)
+        del index._copied
+        return index
+
+    def _copy_on_write(self, key):
+        # Lists and sets of the index this one was updated from must not
+        # be modified, so they are copied the first time they change.
+        if key in self._copied:
+            return
+        self._copied.add(key)
+        if key in self.transactions:
+            self.transactions[key] = list(self.transactions[key])
+            self.spellings[key] = set(self.spellings[key])
+
+    def _copy_substrings_on_write(self):
+        if None not in self._copied:
+            self._copied.add(None)
+            self.substrings = self.substrings.copy()
+
+    def _add(self, transaction):
+        payee = transaction.payee
+        key = payee.lower()
+        self._copy_on_write(key)
+        if payee not in self.payees:
+            self.payees[payee] = 0
+            self.order[payee] = self.next_order
+            self.next_order += 1
+        self.payees[payee] += 1
+        if key not in self.transactions:
+            self.transactions[key] = []
+            self.spellings[key] = set()
+            self._copy_substrings_on_write()
+            self.substrings.add(key)
+        self.transactions[key].append(transaction)
+        self.spellings[key].add(payee)
+
+    def _remove(self, transaction):
+        payee = transaction.payee
+        key = payee.lower()
+        self._copy_on_write(key)
+        self.payees[payee] -= 1
+        if not self.payees[payee]:
+            del self.payees[payee]
+            del self.order[payee]
+            self.spellings[key].discard(payee)
+        self.transactions[key].remove(transaction)
+        if not self.transactions[key]:
+            del self.transactions[key]
+            del self.spellings[key]
+            self._copy_substrings_on_write()
+            self.substrings.remove(key)
+
+    def all_payees(self):
+        """Returns a list of the payees, in order of first appearance."""
+        return list(self.payees)
+
+    def transactions_with_payee(self, payee, case_sensitive=True):
+        """Returns the transactions with the payee, perhaps ignoring case,
+        like journal.transactions_with_payee()."""
+        transes = self.transactions.get(payee.lower(), [])
+        if case_sensitive:
+            return [t for t in transes if t.payee == payee]
+        return list(transes)
+
+    def search(self, text):
+        """Returns the payees that contain text, ignoring case, in order
+        of first appearance."""
+        payees = [
+            p
+            for key in self.substrings.search(text.lower())
+            for p in self.spellings[key]
+        ]
+        return sorted(payees, key=self.order.__getitem__)
+
+
+class Completer(object):
+    """Completes what the user typed with the strings that contain it,
+    ignoring case.  Strings used more often come first, and strings used
+    equally often are ranked by how recently they were used."""
+
+    def __init__(self, usages=()):
+        # String -> number of uses.
+        self.frequency = dict()
+        # String -> sequence number of its last use.
+        self.recency = dict()
+        self.next_use = 0
+        # Lowercased string -> set of strings.
+        self.spellings = dict()
+        # Lowercased strings.
+        self.substrings = SubstringIndex()
+        self._ranked = None
+        for string in usages:
+            self.use(string)
+
+    def __len__(self):
+        return len(self.frequency)
+
+    def add(self, string):
+        """Adds the string without counting a use of it."""
+        if string in self.frequency:
+            return
+        self.frequency[string] = 0
+        self.recency[string] = -1
+        key = string.lower()
+        if key not in self.spellings:
+            self.spellings[key] = set()
+            self.substrings.add(key)
+        self.spellings[key].add(string)
+        self._ranked = None
+
+    def use(self, string):
+        """Counts a use of the string, adding it if needed."""
+        self.add(string)
+        self.frequency[string] += 1
+        self.recency[string] = self.next_use
+        self.next_use += 1
+        self._ranked = None
+
+    def _rank_key(self, text):
+        """Returns the sort key that ranks the strings matching text."""
+        return lambda s: (-self.frequency[s], -self.recency[s], s)
+
+    def complete(self, text, limit=None):
+        """Returns the strings that contain text, best ranked first.
+        Returns at most limit strings, if limit is not None."""
+        if not text:
+            # Everything matches, so rank everything once.
+            if self._ranked is None:
+                self._ranked = sorted(self.frequency, key=self._rank_key(""))
+            ranked = self._ranked
+            return ranked[:limit] if limit is not None else list(ranked)
+        matches = [
+            s
+            for key in self.substrings.search(text.lower())
+            for s in self.spellings[key]
+        ]
+        if limit is None:
+            return sorted(matches, key=self._rank_key(text))
+        return heapq.nsmallest(limit, matches, key=self._rank_key(text))
+
+
+class AccountMatcher(Completer):
+    """Completer of account names that ranks first the accounts with a
+    segment (the text between colons) that starts with what the user
+    typed, so "ex" ranks "Expenses:Food" before "Assets:Tax:Excise".
+
+    Build it once and complete with it on every keystroke: the accounts
+    are lowercased once, and the segments are kept sorted so the
+    accounts with a segment starting with the text are found by
+    bisection."""
+
+    def __init__(self, usages=()):
+        # Account -> lowercased account.
+        self.folded = dict()
+        # Sorted (lowercased account from the start of a segment,
+        # account) pairs, or None if accounts were added since sorting.
+        self._segments = None
+        # Account -> position in complete(""), accounts and lowercased
+        # accounts in that order, and first one or two letters of a
+        # segment -> accounts with such a segment, in that order, or
+        # None if uses were counted since ranking.
+        self._positions = None
+        self._ranking = None
+        self._folded_ranking = None
+        self._by_start = None
+        Completer.__init__(self, usages)
+
+    def add(self, string):
+        if string not in self.folded:
+            self.folded[string] = string.lower()
+            self._segments = None
+        Completer.add(self, string)
+        self._positions = None
+
+    def use(self, string):
+        Completer.use(self, string)
+        self._positions = None
+
+    def _segment_index(self):
+        if self._segments is None:
+            segments = [p for s in self.folded for p in self._split(s)]
+            segments.sort()
+            self._segments = segments
+        return self._segments
+
+    def _position_index(self):
+        if self._positions is None:
+            ranking = Completer.complete(self, "")
+            by_start = dict()
+            for s in ranking:
+                starts = set()
+                for segment, _ in self._split(s):
+                    starts.add(segment[:1])
+                    starts.add(segment[:2])
+                for start in starts:
+                    if start not in by_start:
+                        by_start[start] = []
+                    by_start[start].append(s)
+            self._positions = dict((s, n) for n, s in enumerate(ranking))
+            self._ranking = ranking
+            self._folded_ranking = [self.folded[s] for s in ranking]
+            self._by_start = by_start
+        return self._positions
+
+    def _split(self, string):
+        folded = self.folded[string]
+        start = 0
+        while True:
+            yield folded[start:], string
+            start = folded.find(":", start) + 1
+            if not start:
+                break
+
+    def _best_by_segment(self, key, limit):
+        # The accounts are already ranked, so this stops at the first
+        # limit accounts with a segment that starts with key.
+        ranked = self._by_start.get(key[:2], [])
+        if len(key) < 3:
+            return ranked[:limit]
+        segment = ":" + key
+        found = []
+        for s in ranked:
+            folded = self.folded[s]
+            if folded.startswith(key) or segment in folded:
+                found.append(s)
+                if len(found) == limit:
+                    break
+        return found
+
+    def _containing(self, key, exclude):
+        # Iterates in ranking order without a Python-level loop, which
+        # matters when nothing matches and every account is tested.
+        contain = map(
+            operator.contains, self._folded_ranking, itertools.repeat(key)
+        )
+        return itertools.filterfalse(
+            exclude.__contains__, itertools.compress(self._ranking, contain)
+        )
+
+    def _fewest_containing(self, key):
+        """Returns at least how many accounts the substring index would
+        have to test for key, which must be three or more letters."""
+        return min(
+            len(self.substrings.trigrams.get(t, ())) for t in trigrams(key)
+        )
+
+    def complete(self, text, limit=None):
+        if not text:
+            return Completer.complete(self, text, limit)
+        key = text.lower()
+        segments = self._segment_index()
+        position = self._position_index().__getitem__
+        # When a good part of the accounts may match, going through
+        # them in ranking order until limit match is cheaper than
+        # ranking all that match.
+        dense = lambda n: limit is not None and n * n > limit * len(self)
+        lo = bisect.bisect_left(segments, (key,))
+        hi = bisect.bisect_left(segments, (key + "\U0010ffff",), lo)
+        if len(key) < 3 and limit is not None or dense(hi - lo):
+            first = self._best_by_segment(key, limit)
+        else:
+            first = sorted(
+                set(s for _, s in segments[lo:hi]), key=position
+            )[:limit]
+        if limit is not None:
+            if len(first) == limit:
+                return first
+            limit -= len(first)
+        exclude = set(first)
+        if len(key) < 3 or dense(self._fewest_containing(key)):
+            rest = itertools.islice(self._containing(key, exclude), limit)
+        else:
+            rest = sorted(
+                (
+                    s
+                    for k in self.substrings.search(key)
+                    for s in self.spellings[k]
+                    if s not in exclude
+                ),
+                key=position,
+            )
+        return first + list(rest)[:limit]
+
+
+def payee_completer(tokens):
+    """Returns a Completer of the payees of the transactions among the
+    lexed tokens."""
+    return Completer(
+        t.payee for t in tokens if isinstance(t, parser.TokenTransaction)
+    )
+
+
+def account_completer(accounts, tokens):
+    """Returns an AccountMatcher of the accounts, ranked by their use in
+    the postings of the transactions among the lexed tokens."""
+    accounts = [str(a) for a in accounts]
+    known = set(accounts)
+    completer = AccountMatcher(
+        p.account
+        for t in tokens if isinstance(t, parser.TokenTransaction)
+        for p in t.postings
+        if p.account in known
+    )
+    for account in accounts:
+        completer.add(account)
+    return completer
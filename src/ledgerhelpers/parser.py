@@ -1,5 +1,14 @@
 #!/usr/bin/python3
 
+import array
+import bisect
+import collections
+import itertools
+import multiprocessing
+import operator
+import os
+import re
+
 import ledgerhelpers.legacy
 from ledgerhelpers import diffing
 
@@ -16,6 +25,20 @@ STATE_CLEARED = CHAR_CLEARED
 STATE_PENDING = CHAR_PENDING
 STATE_UNCLEARED = None
 
+RE_NON_WHITESPACE = re.compile("[^" + CHAR_WHITESPACE + CHAR_ENTER + "]")
+RE_TRANSACTION_DATE = re.compile("[-/0-9]*")
+RE_CHUNK_START = re.compile("[" + CHAR_NUMBER + "PC]|tag|python|include")
+RE_CHUNK_BOUNDARY = re.compile(
+    CHAR_ENTER + "(?=" + RE_CHUNK_START.pattern + ")"
+)
+
+VERIFY_FULL = "full"
+VERIFY_CONTINUITY = "continuity"
+VERIFY_NONE = "none"
+
+PARALLEL_LEXING_MIN_CHUNK_SIZE = 1024 * 1024
+STREAMING_CHUNK_SIZE = 64 * 1024
+
 
 def pos_within_items_to_row_and_col(pos, items):
     row = 1
@@ -31,17 +54,76 @@ def pos_within_items_to_row_and_col(pos, items):
     return row, col
 
 
+class LineIndex(object):
+    """Index of the newlines in a text, which maps positions within the
+    text to line and column numbers in logarithmic time.
+
+    Positions are character offsets.  The pos of lexed tokens counts
+    tokens instead, so the offset where a token starts is the sum of the
+    lengths of the contents of the tokens before it."""
+
+    def __init__(self, text):
+        self.newlines = array.array("q", (
+            m.start() for m in re.finditer(CHAR_ENTER, text)
+        ))
+
+    def row_and_col(self, pos):
+        """Returns the 1-based line and column of the character at pos,
+        like pos_within_items_to_row_and_col()."""
+        n = bisect.bisect_left(self.newlines, pos)
+        if n:
+            return n + 1, pos - self.newlines[n - 1]
+        return 1, pos + 1
+
+    def line(self, pos):
+        """Returns the 1-based line of the character at pos."""
+        return bisect.bisect_left(self.newlines, pos) + 1
+
+
 def parse_date_from_transaction_contents(contents):
     return ledgerhelpers.legacy.parse_date("".join(contents))
 
 
+def parse_date_from_transaction_header(contents):
+    """Returns the date at the start of the transaction text, without
+    lexing the rest of the transaction."""
+    end = RE_TRANSACTION_DATE.match(contents).end()
+    if end >= len(contents):
+        raise TransactionLexingError("incomplete transaction")
+    if contents[end] != "=" and contents[end] not in CHAR_WHITESPACE:
+        raise TransactionLexingError("invalid character %s" % contents[end])
+    return parse_date_from_transaction_contents(contents[:end])
+
+
 class Token(object):
 
+    __slots__ = ("pos", "_contents", "_buffer", "_start", "_end")
+
     def __init__(self, pos, contents):
         self.pos = pos
         if not isinstance(contents, str):
             contents = "".join(contents)
-        self.contents = contents
+        self._contents = contents
+        self._buffer = None
+
+    @property
+    def contents(self):
+        if self._buffer is not None:
+            return self._buffer[self._start:self._end].decode("utf-8")
+        return self._contents
+
+    def share_buffer(self, buffer, start, end):
+        """Drops the contents of the token, which from now on are decoded
+        from the UTF-8 bytes buffer[start:end] whenever they are needed."""
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._contents = None
+
+    def encoded_length(self):
+        if self._buffer is not None:
+            return self._end - self._start
+        return len(self._contents.encode("utf-8"))
 
     def __str__(self):
         return """<%s at pos %d len %d
@@ -49,30 +131,61 @@ class Token(object):
 
 
 class TokenComment(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenTransactionComment(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenTransactionClearedFlag(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenTransactionPendingFlag(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenWhitespace(Token):
-    pass
+    __slots__ = ()
+
+
+TransactionDetails = collections.namedtuple(
+    'TransactionDetails',
+    ['secondary_date', 'state', 'clearing_date', 'payee', 'postings']
+)
 
 
 class TokenTransaction(Token):
+    """A transaction.  Only the date is parsed when the token is created;
+    the rest of the transaction is lexed the first time any of payee,
+    state, secondary_date, clearing_date or postings is accessed."""
+
+    __slots__ = ("date", "_details")
 
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
-        lexer = LedgerTransactionLexer(contents)
+        self.date = parse_date_from_transaction_header(self.contents)
+        self._details = None
+
+    def details(self):
+        """Returns the TransactionDetails of this transaction, lexing
+        the transaction body on first use."""
+        if self._details is None:
+            try:
+                self._details = self._lex_details()
+            except Exception as e:
+                # The body is lexed apart from the file, so the error
+                # tells which transaction it is in rather than where.
+                raise TransactionLexingError(
+                    "bad ledger data in transaction %r: %s" % (
+                        self.contents.split("\n", 1)[0], e
+                    )
+                )
+        return self._details
+
+    def _lex_details(self):
+        lexer = LedgerTransactionLexer(self.contents)
         lexer.run()
 
         def find_token(klass):
@@ -82,33 +195,28 @@ class TokenTransaction(Token):
                 return None
 
         try:
-            self.date = find_token(TokenTransactionDate).date
-        except AttributeError:
-            raise TransactionLexingError("no transaction date in transaction")
-
-        try:
-            self.secondary_date = find_token(
+            secondary_date = find_token(
                 TokenTransactionSecondaryDate
             ).date
         except AttributeError:
-            self.secondary_date = None
+            secondary_date = None
 
         if find_token(TokenTransactionClearedFlag):
-            self.state = STATE_CLEARED
+            state = STATE_CLEARED
         elif find_token(TokenTransactionPendingFlag):
-            self.state = STATE_PENDING
+            state = STATE_PENDING
         else:
-            self.state = STATE_UNCLEARED
+            state = STATE_UNCLEARED
 
-        if self.state != STATE_UNCLEARED:
-            self.clearing_date = (
-                self.secondary_date if self.secondary_date else self.date
+        if state != STATE_UNCLEARED:
+            clearing_date = (
+                secondary_date if secondary_date else self.date
             )
         else:
-            self.clearing_date = None
+            clearing_date = None
 
         try:
-            self.payee = find_token(TokenTransactionPayee).payee
+            payee = find_token(TokenTransactionPayee).payee
         except AttributeError:
             raise TransactionLexingError("no payee in transaction")
 
@@ -136,37 +244,79 @@ class TokenTransaction(Token):
                 )
             last = v
         assert len(x) * 2 == len(accountsamounts), lexer.tokens
-        self.postings = x
+        return TransactionDetails(
+            secondary_date, state, clearing_date, payee, x
+        )
+
+    @property
+    def secondary_date(self):
+        return self.details().secondary_date
+
+    @property
+    def state(self):
+        return self.details().state
+
+    @property
+    def clearing_date(self):
+        return self.details().clearing_date
+
+    @property
+    def payee(self):
+        return self.details().payee
+
+    @property
+    def postings(self):
+        return self.details().postings
 
 
 class TokenTransactionWithContext(TokenTransaction):
 
+    __slots__ = ("tokens", "transaction")
+
     def __init__(self, pos, tokens):
+        self.tokens = tokens
         self.transaction = [
             t for t in tokens if isinstance(t, TokenTransaction)
         ][0]
         self.pos = pos
-        self.contents = "".join(t.contents for t in tokens)
+        self._contents = "".join(t.contents for t in tokens)
+        self._buffer = None
 
     @property
     def date(self):
         return self.transaction.date
 
+    def details(self):
+        return self.transaction.details()
+
 
 class TokenConversion(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenPrice(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenEmbeddedPython(Token):
-    pass
+    __slots__ = ()
+
+
+class TokenInclude(Token):
+
+    __slots__ = ()
+
+    @property
+    def path(self):
+        """The file name or glob pattern of the included files, as
+        written in the directive."""
+        return self.contents.strip()[len("include"):].strip()
 
 
 class TokenTransactionPostingAccount(Token):
 
+    __slots__ = ("account",)
+
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
         self.account = ''.join(contents)
@@ -174,17 +324,21 @@ class TokenTransactionPostingAccount(Token):
 
 class TokenTransactionPostingAmount(Token):
 
+    __slots__ = ("amount",)
+
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
         self.amount = ''.join(contents)
 
 
 class TokenEmbeddedTag(Token):
-    pass
+    __slots__ = ()
 
 
 class TokenTransactionDate(Token):
 
+    __slots__ = ("date",)
+
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
         self.date = parse_date_from_transaction_contents(self.contents)
@@ -192,6 +346,8 @@ class TokenTransactionDate(Token):
 
 class TokenTransactionSecondaryDate(Token):
 
+    __slots__ = ("date",)
+
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
         self.date = parse_date_from_transaction_contents(self.contents)
@@ -199,6 +355,8 @@ class TokenTransactionSecondaryDate(Token):
 
 class TokenTransactionPayee(Token):
 
+    __slots__ = ("payee",)
+
     def __init__(self, pos, contents):
         Token.__init__(self, pos, contents)
         self.payee = ''.join(contents)
@@ -296,6 +454,9 @@ class LedgerTextLexer(GenericLexer):
             if self.confirm_next("tag"):
                 self.emit(TokenWhitespace, chars)
                 return self.state_parsing_embedded_tag
+            if self.confirm_next("include"):
+                self.emit(TokenWhitespace, chars)
+                return self.state_parsing_include
             if self.peek() not in CHAR_WHITESPACE + CHAR_ENTER:
                 _, _, l2, c2 = self._coords()
                 raise LexingError(
@@ -326,6 +487,9 @@ class LedgerTextLexer(GenericLexer):
     def state_parsing_embedded_python(self):
         return self.state_parsing_embedded_directive(TokenEmbeddedPython)
 
+    def state_parsing_include(self):
+        return self.state_parsing_embedded_directive(TokenInclude, False)
+
     def state_parsing_embedded_directive(self, klass, maybe_multiline=True):
         chars = [next(self)]
         while self.more():
@@ -377,6 +541,111 @@ class LedgerTextLexer(GenericLexer):
                 )
 
 
+class LedgerTextLineLexer(LedgerTextLexer):
+    """Lexes ledger text a line at a time, working on slices of the
+    original string rather than on a tuple of characters.
+
+    It produces exactly the same tokens as LedgerTextLexer, which is kept
+    as the reference implementation.  If the text is a chunk of a larger
+    text, first_line is the line of the larger text where it starts, and
+    errors are reported with lines of the larger text."""
+
+    def __init__(self, text, first_line=1):
+        assert isinstance(text, str), type(text)
+        GenericLexer.__init__(self, ())
+        self.items = text
+        self.first_line = first_line
+        self._line_index = None
+
+    @property
+    def line_index(self):
+        """The LineIndex of the text, built the first time it is used to
+        locate errors at positions of the lexer within the text."""
+        if self._line_index is None:
+            self._line_index = LineIndex(self.items)
+        return self._line_index
+
+    def _coords(self):
+        r, c = self.line_index.row_and_col(self._last_emitted_pos)
+        r2, c2 = self.line_index.row_and_col(self.pos)
+        return r + self.first_line - 1, c, r2 + self.first_line - 1, c2
+
+    def emit_since(self, klass, start):
+        if start != self._last_emitted_pos:
+            raise LexingError(
+                "token at position %d does not start where the previous "
+                "token ended at position %d" % (start, self._last_emitted_pos)
+            )
+        self.emit(klass, self.items[start:self.pos])
+
+    def consume_line(self):
+        """Advances the position past the next newline, or to the end."""
+        end = self.items.find(CHAR_ENTER, self.pos)
+        self.pos = len(self.items) if end == -1 else end + 1
+
+    def state_parsing_toplevel_text(self):
+        start = self.pos
+        m = RE_NON_WHITESPACE.search(self.items, self.pos)
+        if not m:
+            self.pos = len(self.items)
+            self.emit_since(TokenWhitespace, start)
+            return
+        self.pos = m.start()
+        if self.peek() in CHAR_COMMENT:
+            state = self.state_parsing_comment
+        elif self.peek() in CHAR_NUMBER:
+            state = self.state_parsing_transaction
+        elif self.items.startswith("P", self.pos):
+            state = self.state_parsing_price
+        elif self.items.startswith("C", self.pos):
+            state = self.state_parsing_conversion
+        elif self.items.startswith("python", self.pos):
+            state = self.state_parsing_embedded_python
+        elif self.items.startswith("tag", self.pos):
+            state = self.state_parsing_embedded_tag
+        elif self.items.startswith("include", self.pos):
+            state = self.state_parsing_include
+        else:
+            _, _, l2, c2 = self._coords()
+            raise LexingError(
+                "unparsable data at line %d, char %d" % (l2, c2)
+            )
+        self.emit_since(TokenWhitespace, start)
+        return state
+
+    def state_parsing_comment(self):
+        start = self.pos
+        self.consume_line()
+        while self.more() and self.peek() in CHAR_COMMENT:
+            self.consume_line()
+        self.emit_since(TokenComment, start)
+        return self.state_parsing_toplevel_text
+
+    def state_parsing_embedded_directive(self, klass, maybe_multiline=True):
+        start = self.pos
+        self.consume_line()
+        if maybe_multiline:
+            while self.more() and self.peek() in CHAR_WHITESPACE + CHAR_ENTER:
+                self.consume_line()
+            if self.more():
+                self.emit_since(klass, start)
+                if self.peek() in CHAR_COMMENT:
+                    return self.state_parsing_comment
+                if self.peek() in CHAR_NUMBER:
+                    return self.state_parsing_transaction
+                return self.state_parsing_toplevel_text
+        self.emit_since(klass, start)
+        return self.state_parsing_toplevel_text
+
+    def state_parsing_transaction(self):
+        start = self.pos
+        self.consume_line()
+        while self.more() and self.peek() in CHAR_WHITESPACE:
+            self.consume_line()
+        self.emit_since(TokenTransaction, start)
+        return self.state_parsing_toplevel_text
+
+
 class LedgerTransactionLexer(GenericLexer):
 
     def __init__(self, text):
@@ -540,21 +809,221 @@ class LedgerContextualLexer(GenericLexer):
                 )
 
 
-def lex_ledger_file_contents(text, debug=False):
-    lexer = LedgerTextLexer(text)
+def split_ledger_text(text, chunks):
+    """Splits text into at most the given number of chunks of about the
+    same size.  Chunks only start at the beginning of a line with a
+    transaction or a directive, where the lexer is at the top level."""
+    size = len(text) // chunks
+    bounds = [0]
+    for n in range(1, chunks):
+        m = RE_CHUNK_BOUNDARY.search(text, max(n * size, bounds[-1]))
+        if not m:
+            break
+        bounds.append(m.end())
+    bounds.append(len(text))
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def lex_ledger_text_chunk(text, first_line=1):
+    lexer = LedgerTextLineLexer(text, first_line)
     lexer.run()
-    concat_lexed = "".join([x.contents for x in lexer.tokens])
-    if concat_lexed != text:
-        if debug:
-            u = "Debugging error lexing text: files differ\n\n"
-            diffing.two_way_diff(u + text, u + concat_lexed)
-        raise LexingError("the lexed contents and the original contents are not the same")
-    lexer = LedgerContextualLexer(lexer.tokens)
+    return lexer.tokens
+
+
+def iter_joined_ledger_text_chunks(chunks):
+    """Given an iterable of the tokens lexed from each chunk of a text
+    split where split_ledger_text() splits, yields the tokens that lexing
+    the whole text yields."""
+    offset = 0
+    last = None
+    after_directive = False
+    for tokens in chunks:
+        for token in tokens:
+            token.pos += offset
+        offset = tokens[-1].pos
+        if last is not None:
+            # Every chunk ends and starts with whitespace, as the lexer is
+            # at the top level at chunk boundaries.  A transaction right
+            # after a multiline directive has no whitespace before it,
+            # though.
+            first = tokens[0]
+            if not (
+                not last.contents and not first.contents and
+                after_directive and isinstance(tokens[1], TokenTransaction)
+            ):
+                yield TokenWhitespace(first.pos, last.contents + first.contents)
+            tokens = tokens[1:]
+        last = tokens.pop()
+        after_directive = bool(tokens) and isinstance(
+            tokens[-1], (TokenEmbeddedPython, TokenEmbeddedTag)
+        )
+        for token in tokens:
+            yield token
+    if last is not None:
+        yield last
+
+
+def join_ledger_text_chunks(chunks):
+    """Given the tokens lexed from each chunk that split_ledger_text()
+    returned, returns the tokens that lexing the whole text yields."""
+    return list(iter_joined_ledger_text_chunks(chunks))
+
+
+def iter_ledger_text_chunks(fileobj, chunk_size=STREAMING_CHUNK_SIZE):
+    """Reads ledger text from fileobj line by line, and yields it in
+    chunks of about chunk_size characters, split where split_ledger_text()
+    would split.  A chunk only grows past chunk_size until the next line
+    where it can be split."""
+    lines = []
+    size = 0
+    for line in fileobj:
+        if lines and size >= chunk_size and RE_CHUNK_START.match(line):
+            yield "".join(lines)
+            lines = []
+            size = 0
+        lines.append(line)
+        size += len(line)
+    yield "".join(lines)
+
+
+def iter_ledger_tokens(fileobj, chunk_size=STREAMING_CHUNK_SIZE):
+    """Lexes the ledger text read from the text file object fileobj, and
+    yields the same top level tokens as LedgerTextLineLexer does, without
+    ever holding much more than chunk_size characters of text in memory.
+
+    Unlike lex_ledger_file_contents(), this does not group comments with
+    transactions, and token positions are the character offsets where
+    tokens end."""
+    def lexed_chunks():
+        line = 1
+        for chunk in iter_ledger_text_chunks(fileobj, chunk_size):
+            yield lex_ledger_text_chunk(chunk, line)
+            line += chunk.count(CHAR_ENTER)
+    return iter_joined_ledger_text_chunks(lexed_chunks())
+
+
+def _pool_context():
+    """Returns the multiprocessing context to start lexing processes in.
+    Journals are lexed in threads of programs, so the processes are
+    started from a fork server, or else spawned, rather than forked
+    from the threads."""
+    try:
+        return multiprocessing.get_context("forkserver")
+    except ValueError:
+        return multiprocessing.get_context("spawn")
+
+
+def lex_ledger_text_in_parallel(text, processes,
+                                min_chunk_size=PARALLEL_LEXING_MIN_CHUNK_SIZE):
+    """Lexes text like LedgerTextLineLexer does, split into chunks of at
+    least min_chunk_size characters that are lexed in a pool of processes.
+    Returns the tokens."""
+    chunks = split_ledger_text(
+        text, max(min(processes, len(text) // min_chunk_size), 1)
+    )
+    if len(chunks) == 1:
+        return lex_ledger_text_chunk(text)
+    first_lines = [1]
+    for chunk in chunks[:-1]:
+        first_lines.append(first_lines[-1] + chunk.count(CHAR_ENTER))
+    with _pool_context().Pool(len(chunks)) as pool:
+        return join_ledger_text_chunks(
+            pool.starmap(lex_ledger_text_chunk, zip(chunks, first_lines))
+        )
+
+
+def lex_ledger_file_contents(text, debug=False, processes=1,
+                             verify=VERIFY_FULL):
+    """Lexes ledger text and returns the tokens.  If processes is larger
+    than 1, large texts are lexed in parallel by that many processes.
+    A value of 0 uses one process per CPU.
+
+    verify selects how the tokens are checked against the text.
+    VERIFY_FULL compares the concatenated contents of the tokens with
+    the text, twice.  VERIFY_CONTINUITY relies on the lexer checking that
+    every token starts where the previous one ended, and only checks that
+    the tokens cover the whole text, without building copies of it.
+    VERIFY_NONE skips the checks on the whole text."""
+    if processes == 0:
+        processes = os.cpu_count() or 1
+    if processes > 1:
+        tokens = lex_ledger_text_in_parallel(text, processes)
+    else:
+        tokens = lex_ledger_text_chunk(text)
+    if verify == VERIFY_FULL:
+        concat_lexed = "".join([x.contents for x in tokens])
+        if concat_lexed != text:
+            if debug:
+                u = "Debugging error lexing text: files differ\n\n"
+                diffing.two_way_diff(u + text, u + concat_lexed)
+            raise LexingError("the lexed contents and the original contents are not the same")
+    elif verify == VERIFY_CONTINUITY:
+        if tokens[-1].pos != len(text):
+            raise LexingError("the lexed contents end at position %d of %d" % (
+                tokens[-1].pos, len(text)
+            ))
+    lexer = LedgerContextualLexer(tokens)
     lexer.run()
-    concat_lexed = "".join([ x.contents for x in lexer.tokens ])
-    if concat_lexed != text:
-        if debug:
-            u = "Debugging error lexing chunks: files differ\n\n"
-            diffing.two_way_diff(u + text, u + concat_lexed)
-        raise LexingError("the lexed chunks and the original chunks are not the same")
+    if verify == VERIFY_FULL:
+        concat_lexed = "".join([ x.contents for x in lexer.tokens ])
+        if concat_lexed != text:
+            if debug:
+                u = "Debugging error lexing chunks: files differ\n\n"
+                diffing.two_way_diff(u + text, u + concat_lexed)
+            raise LexingError("the lexed chunks and the original chunks are not the same")
+    elif verify == VERIFY_CONTINUITY:
+        if sum(len(x.contents) for x in lexer.tokens) != len(text):
+            raise LexingError("the lexed chunks do not cover the original chunks")
     return lexer.tokens
+
+
+def share_buffer(tokens, buffer, offset=0):
+    """Makes the tokens, which must cover a text that was encoded as UTF-8
+    into buffer starting at offset, decode their contents from buffer.
+    Tokens that already use a buffer are left as they are.  Returns the
+    offset in buffer where the tokens end."""
+    for token in tokens:
+        end = offset + token.encoded_length()
+        if token._buffer is None:
+            if isinstance(token, TokenTransactionWithContext):
+                share_buffer(token.tokens, buffer, offset)
+            token.share_buffer(buffer, offset, end)
+        offset = end
+    return offset
+
+
+def lex_appended_ledger_file_contents(tokens, text, previous_length,
+                                      debug=False, verify=VERIFY_FULL):
+    """Given the tokens that lex_ledger_file_contents() returned for the
+    first previous_length characters of text, returns the tokens for
+    the whole of text, lexing only the tail of the text.
+
+    The text must start with the previously lexed text unmodified."""
+    # Tokens may depend on what follows them, so the last tokens are
+    # lexed again starting from the last whitespace before them, which
+    # is always lexed from the top level state.
+    restart = None
+    tail_length = 0
+    for i in range(len(tokens) - 1, -1, -1):
+        if i < len(tokens) - 1 and isinstance(tokens[i], TokenWhitespace):
+            restart = i
+            tail_length += len(tokens[i].contents)
+            break
+        tail_length += len(tokens[i].contents)
+    if restart is None:
+        return lex_ledger_file_contents(text, debug=debug, verify=verify)
+    offset = previous_length - tail_length
+    tail = lex_ledger_file_contents(text[offset:], debug=debug, verify=verify)
+    # Chunk positions count tokens, so shift them past the kept ones.
+    for token in tail:
+        token.pos += tokens[restart].pos - 1
+    return tokens[:restart] + tail
+
+
+def shared_token_count(old, new):
+    """Returns how many tokens at the start of new are the very tokens
+    at the start of old.  Lexing a journal again keeps the tokens of the
+    text before the first change, and of the files that did not change,
+    so the work done for those can be kept."""
+    same = map(operator.is_, old, new)
+    return sum(1 for _ in itertools.takewhile(bool, same))
@@ -13,7 +13,7 @@ from gi.repository import Pango
 
 import ledgerhelpers as common
 from ledgerhelpers import gui
-from ledgerhelpers import journal
+from ledgerhelpers import matching
 from ledgerhelpers.programs import common as common_programs
 import ledgerhelpers.editabletransactionview as ed
 
@@ -71,7 +71,7 @@ class AddTransWindow(Gtk.Window, gui.EscapeHandlingMixin):
 class AddTransApp(AddTransWindow, gui.EscapeHandlingMixin):
 
     logger = logging.getLogger("addtrans")
-    internal_parsing = []
+    payee_index = None
 
     def __init__(self, journal, preferences):
         AddTransWindow.__init__(self)
@@ -81,7 +81,7 @@ class AddTransApp(AddTransWindow, gui.EscapeHandlingMixin):
 
         self.accounts = []
         self.commodities = dict()
-        self.internal_parsing = []
+        self.payee_index = matching.PayeeIndex()
         self.payees = []
 
         self.activate_escape_handling()
@@ -110,40 +110,55 @@ class AddTransApp(AddTransWindow, gui.EscapeHandlingMixin):
 
     def reload_completion_data(self):
         gui.g_async(
-            lambda: self.journal.internal_parsing(),
-            lambda payees: self.internal_parsing_loaded(payees),
+            self.load_payees,
+            lambda r: self.payee_index_loaded(*r),
             self.journal_load_failed,
         )
 
-    def internal_parsing_loaded(self, internal_parsing):
-        self.internal_parsing = internal_parsing
-        gui.g_async(
-            lambda: self.journal.all_payees(),
-            lambda payees: self.all_payees_loaded(payees),
-            self.journal_load_failed,
-        )
+    def load_payees(self):
+        payee_index = self.journal.payee_index()
+        return payee_index, matching.payee_completer(payee_index.tokens)
 
-    def all_payees_loaded(self, payees):
-        self.payees = payees
-        self.transholder.set_payees_for_completion(self.payees)
+    def payee_index_loaded(self, payee_index, payee_completer):
+        self.payee_index = payee_index
+        self.payees = payee_index.all_payees()
+        self.transholder.set_payees_for_completion(payee_completer)
         gui.g_async(
-            lambda: self.journal.accounts_and_last_commodity_for_account(),
+            self.load_accounts_and_last_commodities,
             lambda r: self.accounts_and_last_commodities_loaded(*r),
             self.journal_load_failed,
         )
         if self.status.get_text() == ASYNC_LOAD_MESSAGE:
             self.status.set_text(ASYNC_LOADING_ACCOUNTS_MESSAGE)
 
-    def accounts_and_last_commodities_loaded(self, accounts, last_commos):
+    def load_accounts_and_last_commodities(self, accept_stale=None):
+        accounts, last_commos = (
+            self.journal.accounts_and_last_commodity_for_account(accept_stale)
+        )
+        completer = matching.account_completer(
+            accounts, self.payee_index.tokens
+        )
+        return accounts, last_commos, completer
+
+    def accounts_and_last_commodities_loaded(self, accounts, last_commos,
+                                             account_completer):
         self.accounts = accounts
         self.commodities = last_commos
-        self.transholder.set_accounts_for_completion(self.accounts)
+        self.transholder.set_accounts_for_completion(account_completer)
         self.transholder.set_default_commodity_getter(
             self.get_commodity_for_account
         )
         self.successfully_loaded_accounts_and_commodities = True
         if self.status.get_text() == ASYNC_LOADING_ACCOUNTS_MESSAGE:
             self.status.set_text("")
+        if self.journal.stale():
+            # Completions are usable meanwhile, and updated once ledger
+            # parsed the journal again.
+            gui.g_async(
+                lambda: self.load_accounts_and_last_commodities(False),
+                lambda r: self.accounts_and_last_commodities_loaded(*r),
+                self.journal_load_failed,
+            )
 
     def journal_load_failed(self, e):
         traceback.print_exception(e)
@@ -166,9 +181,8 @@ class AddTransApp(AddTransWindow, gui.EscapeHandlingMixin):
         self.try_autofill(emitter, text)
 
     def try_autofill(self, transaction_view, autofill_text):
-        ts = journal.transactions_with_payee(
+        ts = self.payee_index.transactions_with_payee(
             autofill_text,
-            self.internal_parsing,
             case_sensitive=False
         )
         if not ts:
@@ -231,8 +245,13 @@ class AddTransApp(AddTransWindow, gui.EscapeHandlingMixin):
 def get_argparser():
     parser = argparse.ArgumentParser(
         'Add new transactions to your Ledger file',
-        parents=[common_programs.get_common_argparser()]
+        parents=[common_programs.get_common_argparser(),
+                 common_programs.get_daemon_argparser()]
     )
+    parser.add_argument('--memory-map', dest='memory_map',
+                        action='store_true',
+                        help='read completion data from a memory map of '
+                        'the ledger file instead of keeping it in memory')
     parser.add_argument('--debug', dest='debug', action='store_true',
                         help='activate debugging')
     return parser
@@ -247,6 +266,13 @@ def main():
     journal, s = gui.load_journal_and_settings_for_gui(
         ledger_file=args.file,
         price_file=args.pricedb,
+        token_cache_dir=common_programs.get_token_cache_dir(args),
+        lexer_processes=args.lexer_processes,
+        memory_map=args.memory_map,
+        daemon_address=common_programs.get_daemon_address(args),
+        # The window shows completions from before the journal changed
+        # rather than wait for ledger to parse it again.
+        accept_stale=True,
     )
     klass = AddTransApp
     win = klass(journal, s)
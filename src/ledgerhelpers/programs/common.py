@@ -2,6 +2,8 @@
 
 import argparse
 
+from ledgerhelpers import daemon, tokencache
+
 
 def get_common_argparser():
     parser = argparse.ArgumentParser(add_help=False)
@@ -9,4 +11,38 @@ def get_common_argparser():
                         help='specify path to ledger file to work with')
     parser.add_argument('--price-db', dest='pricedb', action='store',
                         help='specify path to ledger price database to work with')
+    parser.add_argument('--no-token-cache', dest='no_token_cache',
+                        action='store_true',
+                        help='do not cache the lexed ledger file in %s' %
+                        tokencache.default_cache_dir())
+    parser.add_argument('--lexer-processes', dest='lexer_processes',
+                        action='store', type=int, default=1,
+                        help='lex large ledger files in parallel using this '
+                        'many processes (0 uses one process per CPU)')
+    return parser
+
+
+def get_daemon_argparser():
+    """Returns the parent parser of the options of the programs that can
+    have ledgerhelpers-daemon parse the ledger file for them."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--no-daemon', dest='no_daemon', action='store_true',
+                        help='parse the ledger file in this program even if '
+                        'ledgerhelpers-daemon is running')
     return parser
+
+
+def get_token_cache_dir(args):
+    """Returns the token cache directory selected by the command line
+    arguments, or None if the token cache was disabled."""
+    if args.no_token_cache:
+        return None
+    return tokencache.default_cache_dir()
+
+
+def get_daemon_address(args):
+    """Returns the address of the journal daemon to use, or None if the
+    command line arguments disabled it."""
+    if args.no_daemon:
+        return None
+    return daemon.default_address()
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+
+import argparse
+import sys
+
+import ledgerhelpers
+from ledgerhelpers import daemon
+
+
+def get_argparser():
+    parser = argparse.ArgumentParser(
+        description="Keep ledger journals parsed for the ledgerhelpers "
+        "programs."
+    )
+    parser.add_argument('--socket', dest='socket', action='store',
+                        default=daemon.default_address(),
+                        help='listen on this UNIX socket (default %(default)s)')
+    parser.add_argument('--poll-interval', dest='poll_interval',
+                        action='store', type=float,
+                        default=daemon.POLL_INTERVAL,
+                        help='check the journals for changes this often, '
+                        'in seconds, where inotify is not available')
+    parser.add_argument('--debug', dest='debug', action='store_true',
+                        help='do debugging')
+    return parser
+
+
+def main(argv=None):
+    args = get_argparser().parse_args(argv)
+    ledgerhelpers.enable_debugging(args.debug)
+    d = daemon.JournalDaemon(args.socket, args.poll_interval)
+    try:
+        d.listen()
+    except (OSError, daemon.DaemonAlreadyRunning) as e:
+        print("Cannot start: %s" % e, file=sys.stderr)
+        return 1
+    d.serve_forever()
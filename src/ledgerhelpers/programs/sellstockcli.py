@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import argparse
 import datetime
 import fnmatch
 import ledger
@@ -8,6 +9,8 @@ import subprocess
 import sys
 import ledgerhelpers.legacy as common
 from ledgerhelpers import gui
+from ledgerhelpers import matching
+from ledgerhelpers.programs import common as common_programs
 
 
 class Lot(object):
@@ -114,13 +117,29 @@ def matches(string, options):
     return False
 
 
+def get_argparser():
+    return argparse.ArgumentParser(
+        'Record sales of stock or commodities in your Ledger file',
+        parents=[common_programs.get_common_argparser(),
+                 common_programs.get_daemon_argparser()]
+    )
+
+
 def main():
-    journal, s = gui.load_journal_and_settings_for_gui()
+    args = get_argparser().parse_args()
+    journal, s = gui.load_journal_and_settings_for_gui(
+        ledger_file=args.file,
+        price_file=args.pricedb,
+        token_cache_dir=common_programs.get_token_cache_dir(args),
+        lexer_processes=args.lexer_processes,
+        daemon_address=common_programs.get_daemon_address(args),
+    )
     accts, unused_commodities = journal.accounts_and_last_commodity_for_account()
+    matcher = matching.account_completer(accts, journal.internal_parsing())
 
     saleacct = common.prompt_for_account(
         sys.stdin, sys.stdout,
-        accts, "Which account was the sold commodity stored in?",
+        matcher, "Which account was the sold commodity stored in?",
         s.get("last_sellstock_account", None)
     )
     assert saleacct, "Not an account: %s" % saleacct
@@ -128,7 +147,7 @@ def main():
 
     commissionsaccount = common.prompt_for_account(
         sys.stdin, sys.stdout,
-        accts, "Which account to account for commissions?",
+        matcher, "Which account to account for commissions?",
         s.get("last_commissions_account", None)
     )
     assert commissionsaccount, "Not an account: %s" % commissionsaccount
@@ -136,7 +155,7 @@ def main():
 
     gainslossesacct = common.prompt_for_account(
         sys.stdin, sys.stdout,
-        accts, "Which account to credit gains and losses?",
+        matcher, "Which account to credit gains and losses?",
         s.get("last_gainslosses_account",
               "Capital:Recognized gains and losses")
     )
@@ -2,15 +2,13 @@
 
 import argparse
 import codecs
-import collections
 import datetime
-import itertools
 import subprocess
 import sys
 
 from ledgerhelpers import diffing
-from ledgerhelpers import parser
 from ledgerhelpers import gui
+from ledgerhelpers import tokencache
 from ledgerhelpers.programs import common as common_programs
 
 
@@ -28,29 +26,25 @@ def get_argparser():
 
 
 def sort_transactions(items):
+    """Yields the items sorted by date, keeping items of the same date in
+    their original order.  Items without a date sort along with the next
+    item that has one, except for the items before the first transaction,
+    which stay at the start."""
     smallest_date = datetime.date(1000, 1, 1)
     largest_date = datetime.date(3000, 1, 1)
-    bydates = collections.OrderedDict()
-    first_transaction_seen = False
+    dates = [None] * len(items)
+    date = largest_date
+    for n in range(len(items) - 1, -1, -1):
+        item_date = getattr(items[n], "date", None)
+        if item_date is not None:
+            date = item_date
+        dates[n] = date
     for n, item in enumerate(items):
         if hasattr(item, "date"):
-            first_transaction_seen = True
-        if first_transaction_seen:
-            later_dates = itertools.chain(
-                (getattr(items[i], "date", None) for i in range(n, len(items))),
-                [largest_date]
-            )
-            for date in later_dates:
-                if date is not None:
-                    break
-        else:
-            date = smallest_date
-        if date not in bydates:
-            bydates[date] = []
-        bydates[date] += [item]
-    for date in sorted(bydates):
-        for item in bydates[date]:
-            yield item
+            break
+        dates[n] = smallest_date
+    for n in sorted(range(len(items)), key=dates.__getitem__):
+        yield items[n]
 
 
 def main(argv):
@@ -62,7 +56,12 @@ def main(argv):
         ledgerfile = gui.find_ledger_file_for_gui()
     try:
         leftcontents = codecs.open(ledgerfile, "rb", "utf-8").read()
-        items = parser.lex_ledger_file_contents(leftcontents, debug=args.debug)
+        items = tokencache.lex_ledger_file_contents(
+            ledgerfile, leftcontents,
+            cache_dir=common_programs.get_token_cache_dir(args),
+            debug=args.debug,
+            processes=args.lexer_processes,
+        )
         rightcontents = "".join(i.contents for i in sort_transactions(items))
         if args.assume_yes:
             with open(ledgerfile, "w") as out_file:
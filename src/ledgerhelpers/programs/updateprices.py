@@ -8,6 +8,7 @@ import json
 import ledger
 import ledgerhelpers
 from ledgerhelpers import gui
+from ledgerhelpers.programs import common as common_programs
 import threading
 import traceback
 import urllib.parse
@@ -22,7 +23,9 @@ from gi.repository import Gtk
 
 def get_argparser():
     parser = argparse.ArgumentParser(
-        'Update prices in a Ledger price file'
+        'Update prices in a Ledger price file',
+        parents=[common_programs.get_common_argparser(),
+                 common_programs.get_daemon_argparser()]
     )
     parser.add_argument('-b', dest='batch', action='store_true',
                         help='update price file in batch (non-GUI) mode')
@@ -826,7 +829,12 @@ def main(argv):
     GObject.threads_init()
 
     journal, settings = gui.load_journal_and_settings_for_gui(
-        price_file_mandatory=True
+        price_file_mandatory=True,
+        ledger_file=args.file,
+        price_file=args.pricedb,
+        token_cache_dir=common_programs.get_token_cache_dir(args),
+        lexer_processes=args.lexer_processes,
+        daemon_address=common_programs.get_daemon_address(args),
     )
     klass = UpdatePricesApp if not args.batch else UpdatePricesCommon
     app = klass(journal, settings)
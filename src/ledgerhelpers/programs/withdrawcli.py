@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 
+import argparse
 import datetime
 import ledger
 import os
@@ -8,12 +9,29 @@ import ledgerhelpers
 import ledgerhelpers.legacy as common
 import ledgerhelpers.legacy_needsledger as common2
 import ledgerhelpers.journal as journal
+from ledgerhelpers import matching
+from ledgerhelpers.programs import common as common_programs
+
+
+def get_argparser():
+    return argparse.ArgumentParser(
+        'Record cash withdrawals in your Ledger file',
+        parents=[common_programs.get_common_argparser(),
+                 common_programs.get_daemon_argparser()]
+    )
 
 
 def main():
+    args = get_argparser().parse_args()
     s = ledgerhelpers.Settings.load_or_defaults(os.path.expanduser("~/.ledgerhelpers.ini"))
-    j = journal.Journal.from_file(ledgerhelpers.find_ledger_file(), None)
+    j = journal.Journal.from_file(
+        ledgerhelpers.find_ledger_file(args.file), args.pricedb,
+        token_cache_dir=common_programs.get_token_cache_dir(args),
+        lexer_processes=args.lexer_processes,
+        daemon_address=common_programs.get_daemon_address(args),
+    )
     accts, commodities = j.accounts_and_last_commodity_for_account()
+    matcher = matching.account_completer(accts, j.internal_parsing())
 
     when = common.prompt_for_date(
         sys.stdin, sys.stdout,
@@ -27,7 +45,7 @@ def main():
 
     asset1 = common.prompt_for_account(
         sys.stdin, sys.stdout,
-        accts, "From where?",
+        matcher, "From where?",
         s.get("last_withdrawal_account", None)
     )
     assert asset1, "Not an account: %s" % asset1
@@ -36,7 +54,7 @@ def main():
 
     asset2 = common.prompt_for_account(
         sys.stdin, sys.stdout,
-        accts, "To where?",
+        matcher, "To where?",
         s.get("last_deposit_account", None)
     )
     assert asset2, "Not an account: %s" % asset2
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from ledgerhelpers import parser
+
+
+log = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+
+# The position of each class in this tuple is its code in the cache file.
+# Append new classes at the end, or bump CACHE_FORMAT_VERSION.
+TOKEN_CLASSES = (
+    parser.TokenWhitespace,
+    parser.TokenComment,
+    parser.TokenTransaction,
+    parser.TokenTransactionWithContext,
+    parser.TokenPrice,
+    parser.TokenConversion,
+    parser.TokenEmbeddedPython,
+    parser.TokenEmbeddedTag,
+    parser.TokenInclude,
+)
+TOKEN_CODES = dict((klass, code) for code, klass in enumerate(TOKEN_CLASSES))
+
+
+def default_cache_dir():
+    """Returns the ledgerhelpers directory within the XDG cache directory."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "ledgerhelpers")
+
+
+def cache_file_for(path, cache_dir):
+    name = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "tokens-%s.json" % name)
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def tokens_to_records(tokens):
+    """Returns a list of [code, pos, length] records for the tokens.
+    Tokens made of other tokens have the list of their records in place
+    of the length."""
+    records = []
+    for token in tokens:
+        code = TOKEN_CODES[type(token)]
+        if isinstance(token, parser.TokenTransactionWithContext):
+            records.append([code, token.pos, tokens_to_records(token.tokens)])
+        else:
+            records.append([code, token.pos, len(token.contents)])
+    return records
+
+
+def records_to_tokens(records, text, offset=0):
+    """Rebuilds the tokens that tokens_to_records() described, taking
+    their contents from the text, starting at offset."""
+    tokens = []
+    for code, pos, length in records:
+        klass = TOKEN_CLASSES[code]
+        if isinstance(length, list):
+            token = klass(pos, records_to_tokens(length, text, offset))
+        else:
+            token = klass(pos, text[offset:offset + length])
+        offset += len(token.contents)
+        tokens.append(token)
+    return tokens
+
+
+def load(path, text, cache_dir):
+    """Returns the cached tokens of the file at path, if the cache matches
+    the file and its contents, which must be supplied as text.  Returns
+    None otherwise."""
+    try:
+        s = os.stat(path)
+        with open(cache_file_for(path, cache_dir), "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as e:
+        if getattr(e, "errno", None) != errno.ENOENT:
+            log.debug("Cannot read token cache for %s: %s", path, e)
+        return None
+    if (
+        cached.get("version") != CACHE_FORMAT_VERSION or
+        cached.get("path") != os.path.abspath(path) or
+        cached.get("size") != s.st_size or
+        cached.get("mtime") != s.st_mtime or
+        cached.get("digest") != text_digest(text)
+    ):
+        log.debug("Token cache for %s is stale.", path)
+        return None
+    try:
+        tokens = records_to_tokens(cached["tokens"], text)
+    except Exception as e:
+        log.debug("Cannot load token cache for %s: %s", path, e)
+        return None
+    if sum(len(t.contents) for t in tokens) != len(text):
+        log.debug("Token cache for %s does not cover the file.", path)
+        return None
+    return tokens
+
+
+def store(path, text, tokens, cache_dir):
+    """Saves the tokens of the file at path, whose contents are text,
+    into the cache.  Errors are logged and otherwise ignored."""
+    try:
+        s = os.stat(path)
+        cached = {
+            "version": CACHE_FORMAT_VERSION,
+            "path": os.path.abspath(path),
+            "size": s.st_size,
+            "mtime": s.st_mtime,
+            "digest": text_digest(text),
+            "tokens": tokens_to_records(tokens),
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tokens-", dir=cache_dir)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cached, f, separators=(",", ":"))
+            os.rename(tmp, cache_file_for(path, cache_dir))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError as e:
+        log.debug("Cannot write token cache for %s: %s", path, e)
+
+
+def lex_ledger_file_contents(path, text, cache_dir=None, debug=False,
+                             processes=1, verify=parser.VERIFY_FULL):
+    """Like parser.lex_ledger_file_contents(), but looks the tokens of
+    the file at path up in cache_dir first, and stores them there after
+    lexing.  If cache_dir is None, no cache is used."""
+    if cache_dir is None:
+        return parser.lex_ledger_file_contents(
+            text, debug=debug, processes=processes, verify=verify
+        )
+    tokens = load(path, text, cache_dir)
+    if tokens is not None:
+        log.debug("Loaded %d tokens of %s from cache.", len(tokens), path)
+        return tokens
+    tokens = parser.lex_ledger_file_contents(
+        text, debug=debug, processes=processes, verify=verify
+    )
+    store(path, text, tokens, cache_dir)
+    return tokens
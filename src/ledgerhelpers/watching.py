@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+"""Detection of changes to files.
+
+watch() returns an InotifyWatcher where Linux inotify is available, and
+a StatWatcher otherwise.  Paths may be glob patterns, for which the
+files that start or stop matching count as changes.  Both tell whether the files changed since they
+were last asked, but an InotifyWatcher does it without a system call per
+file, notices rewrites that keep the modification time, and can be
+waited on with wait() so changes are acted upon as soon as they happen.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import logging
+import os
+import struct
+import time
+from multiprocessing import connection
+
+
+log = logging.getLogger(__name__)
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+
+# Changes to the files themselves, and files renamed over them, as
+# editors and Settings do when they write files atomically.
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+EVENT = struct.Struct("iIII")
+
+_libc = None
+
+
+def is_glob(path):
+    """Returns whether path is a glob pattern."""
+    return any(c in path for c in "*?[")
+
+
+def stat_key(path):
+    """Returns what tells whether the file at path changed: its
+    modification time, size and inode, or None if it does not exist.
+    If path is a glob pattern, returns the paths that match it."""
+    if is_glob(path):
+        return sorted(glob.glob(path))
+    try:
+        s = os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    return (s.st_mtime_ns, s.st_size, s.st_ino)
+
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        # Raises AttributeError where there is no inotify.
+        _libc.inotify_init1
+        _libc.inotify_add_watch
+    return _libc
+
+
+class StatWatcher(object):
+    """Tells whether files changed by comparing their modification time,
+    size and inode with those seen last time.  Files that do not exist
+    are fine, and count as changed once they do."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.stats = None
+
+    def changed(self):
+        """Returns True the first time, and then whenever the files
+        changed since the previous call."""
+        stats = [stat_key(p) for p in self.paths]
+        if stats != self.stats:
+            self.stats = stats
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Tells whether files changed by reading the events that inotify
+    queued about them.  The directories of the files are watched, so
+    files that do not exist yet, or are replaced by others, are fine.
+
+    Raises OSError if inotify cannot watch the directories, or if a glob
+    pattern matches directories, and AttributeError where there is no
+    inotify."""
+
+    def __init__(self, paths):
+        libc = _inotify()
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        # Watch descriptor -> names of the files watched in its directory.
+        self.names = dict()
+        # Watch descriptor -> glob patterns of those names.
+        self.patterns = dict()
+        self.first = True
+        try:
+            for path in paths:
+                directory, name = os.path.split(os.path.abspath(path))
+                if is_glob(directory):
+                    raise OSError(errno.EINVAL, "Cannot watch directories "
+                                  "matching a pattern", path)
+                wd = libc.inotify_add_watch(
+                    self.fd, os.fsencode(directory), WATCH_MASK
+                )
+                if wd < 0:
+                    e = ctypes.get_errno()
+                    raise OSError(e, os.strerror(e), directory)
+                if is_glob(name):
+                    self.patterns.setdefault(wd, []).append(name)
+                else:
+                    self.names.setdefault(wd, set()).add(os.fsencode(name))
+        except BaseException:
+            self.close()
+            raise
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self):
+        """Returns True the first time, and then whenever the files
+        changed since the previous call."""
+        changed, self.first = self.first, False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, unused_cookie, length = EVENT.unpack_from(data, pos)
+                pos += EVENT.size
+                name = data[pos:pos + length].rstrip(b"\0")
+                pos += length
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF |
+                           IN_MOVE_SELF):
+                    # Events were lost, or the directory went away.
+                    changed = True
+                elif name in self.names.get(wd, ()):
+                    changed = True
+                elif wd in self.patterns:
+                    name = os.fsdecode(name)
+                    # As with glob, wildcards do not match hidden files.
+                    changed = changed or any(
+                        fnmatch.fnmatchcase(name, p) and
+                        (p.startswith(".") or not name.startswith("."))
+                        for p in self.patterns[wd]
+                    )
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def watch(paths):
+    """Returns a watcher of the files at paths, ignoring paths that are
+    None."""
+    paths = [p for p in paths if p is not None]
+    try:
+        return InotifyWatcher(paths)
+    except (AttributeError, OSError) as e:
+        log.debug("Cannot use inotify, checking files with stat: %s", e)
+        return StatWatcher(paths)
+
+
+def wait(watchers, timeout):
+    """Waits until one of the watchers that can be waited on has changes
+    to tell, or at most timeout seconds.  Watchers that cannot be waited
+    on must be asked again after the timeout."""
+    waitable = [w for w in watchers if hasattr(w, "fileno")]
+    if waitable:
+        connection.wait(waitable, timeout)
+    else:
+        time.sleep(timeout)
@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import ledgerhelpers.daemon as daemon
+from multiprocessing.connection import Client, Listener
+try:
+    import ledgerhelpers.journal as journal
+except ImportError:
+    journal = None
+import tests.test_base as base
+from unittest import TestCase as T
+
+
+class TestDaemon(T):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.address = os.path.join(self.dir, "run", "journal.sock")
+
+    def tearDown(self):
+        self.doCleanups()
+        shutil.rmtree(self.dir)
+
+    def test_connect_without_daemon(self):
+        self.assertRaises(OSError, daemon.connect,
+                          self.address, "journal.dat", None)
+
+    def test_listen_once(self):
+        d = daemon.JournalDaemon(self.address)
+        d.listen()
+        try:
+            self.assertEqual(os.stat(os.path.dirname(self.address)).st_mode
+                             & 0o777, 0o700)
+            self.assertRaises(daemon.DaemonAlreadyRunning,
+                              daemon.JournalDaemon(self.address).listen)
+        finally:
+            d.listener.close()
+        # The socket left behind is stale now.
+        with open(self.address, "w"):
+            pass
+        d = daemon.JournalDaemon(self.address)
+        d.listen()
+        d.listener.close()
+
+    def test_refuses_sockets_others_can_reach(self):
+        directory = os.path.dirname(self.address)
+        os.mkdir(directory, 0o755)
+        os.chmod(directory, 0o755)
+        self.assertRaises(PermissionError,
+                          daemon.JournalDaemon(self.address).listen)
+        listener = Listener(self.address, family="AF_UNIX")
+        self.addCleanup(listener.close)
+        self.assertRaises(PermissionError, daemon.connect,
+                          self.address, "journal.dat", None)
+
+    def test_refuses_other_protocol_versions(self):
+        d = daemon.JournalDaemon(self.address)
+        d.listen()
+        self.addCleanup(d.close)
+        server = threading.Thread(target=d.serve_forever, daemon=True)
+        server.start()
+        conn = Client(self.address, family="AF_UNIX")
+        conn.send((daemon.CMD_OPEN, "journal.dat", None))
+        self.assertIsInstance(conn.recv(), daemon.ProtocolMismatch)
+        conn.close()
+        self.assertEqual(len(d.parsers), 0)
+
+    @unittest.skipIf(journal is None,
+                     reason="ledger-python is not available on this system")
+    def test_journals_share_daemon(self):
+        d = daemon.JournalDaemon(self.address, poll_interval=0.01)
+        d.listen()
+        self.addCleanup(d.close)
+        server = threading.Thread(target=d.serve_forever, daemon=True)
+        server.start()
+        path = os.path.join(self.dir, "journal.dat")
+        shutil.copy(base.datapath("simple_transaction.dat"), path)
+        j1 = journal.Journal.from_file(path, None,
+                                       daemon_address=self.address)
+        j2 = journal.Journal.from_file(path, None,
+                                       daemon_address=self.address)
+        self.assertIsNone(j1.slave)
+        accts, _ = j1.accounts_and_last_commodity_for_account()
+        self.assertListEqual(accts, ["Accounts:Cash", "Expenses:Drinking"])
+        self.assertEqual(len(d.parsers), 1)
+
+        time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+        j1.add_text_to_file(base.data("simple_transaction.dat").replace(
+            "Expenses:Drinking", "Expenses:Food"
+        ))
+        time.sleep(0.1) # Let the daemon notice the change first.
+        for j in (j1, j2):
+            accts, _ = j.accounts_and_last_commodity_for_account()
+            self.assertListEqual(
+                accts,
+                ["Accounts:Cash", "Expenses:Drinking", "Expenses:Food"],
+            )
+        conn = daemon.connect(self.address, path, None)
+        conn.send((journal.CMD_GET_PAYEES,))
+        self.assertListEqual(conn.recv(), ["beer"])
+        conn.send((journal.CMD_GET_TRANSACTIONS_WITH_PAYEE, "beer"))
+        self.assertEqual(len(conn.recv()), 2)
+        conn.close()
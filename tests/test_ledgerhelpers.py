@@ -1,12 +1,16 @@
 import datetime
+import os
+import pickle
 import ledgerhelpers as m
 import ledgerhelpers.legacy as mc
+import ledgerhelpers.parser as parser
 try:
     import ledgerhelpers.journal as journal
 except ImportError:
     journal = None
 import tests.test_base as base
 import tempfile
+import threading
 import time
 import unittest
 from unittest import TestCase as T
@@ -43,6 +47,349 @@ class TestJournal(T):
             _, commos = j.accounts_and_last_commodity_for_account()
             self.assertEqual(commos["Expenses:Drinking"], "1.00 EUR")
 
+    def test_append_only_lexes_new_text(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read() * 2
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            j = journal.Journal.from_file(f.name, None)
+            first = j.internal_parsing()
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            j.add_text_to_file(data.replace("beer", "wine"))
+            items = j.internal_parsing()
+            self.assertIs(items[1], first[1])
+            self.assertListEqual(
+                [x.contents for x in items],
+                [x.contents for x in parser.lex_ledger_file_contents(
+                    data + data.replace("beer", "wine") + "\n"
+                )],
+            )
+            self.assertListEqual(j.all_payees(), ["beer", "wine"])
+            self.assertEqual(
+                len(j.payee_index().transactions_with_payee("beer")), 2
+            )
+
+    def test_follows_includes(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.TemporaryDirectory() as d:
+            main = os.path.join(d, "main.ledger")
+            included = os.path.join(d, "wine.ledger")
+            with open(main, "w") as f:
+                f.write(data + "\ninclude wine.ledger\n")
+            with open(included, "w") as f:
+                f.write(data.replace("beer", "wine"))
+            j = journal.Journal.from_file(main, None)
+            self.assertListEqual(j.all_payees(), ["beer", "wine"])
+            first = j.internal_parsing()
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            with open(included, "w") as f:
+                f.write(data.replace("beer", "cider"))
+            items = j.internal_parsing()
+            # The main file was not lexed again.
+            self.assertIs(items[1], first[1])
+            self.assertListEqual(j.all_payees(), ["beer", "cider"])
+
+    def test_follows_glob_includes(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.TemporaryDirectory() as d:
+            main = os.path.join(d, "main.ledger")
+            with open(main, "w") as f:
+                f.write(data + "\ninclude ./main.ledger\ninclude *.inc\n")
+            j = journal.Journal.from_file(main, None)
+            self.assertListEqual(j.all_payees(), ["beer"])
+            accts, _ = j.accounts_and_last_commodity_for_account()
+            self.assertListEqual(accts, ["Accounts:Cash", "Expenses:Drinking"])
+
+            with open(os.path.join(d, "wine.inc"), "w") as f:
+                f.write(data.replace("Drinking", "Wine"))
+            self.assertListEqual(j.all_payees(), ["beer"])
+            accts, _ = j.accounts_and_last_commodity_for_account()
+            self.assertListEqual(
+                accts,
+                ["Accounts:Cash", "Expenses:Drinking", "Expenses:Wine"],
+            )
+
+    def test_files_that_failed_to_lex_are_lexed_again(self):
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write("2015-03-12")
+            f.flush()
+            lexed = journal.LexedFile(f.name)
+            self.assertRaises(parser.LexingError, lexed.update)
+            self.assertRaises(parser.LexingError, lexed.update)
+            f.write(" beer\n    Expenses:Drinking  1 CHF\n")
+            f.flush()
+            self.assertTrue(lexed.update())
+
+    def test_appended_transactions_are_parsed_alone(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            p = journal.JournalParser(f.name, None)
+            parsed = []
+            worker = p._ledger_worker()
+            harvest = worker.harvest
+
+            def recording_harvest(text, stripped):
+                parsed.append(text)
+                return harvest(text, stripped)
+
+            worker.harvest = recording_harvest
+            p.update_ledger()
+            self.assertListEqual(parsed, [data])
+
+            appended = data.replace("Expenses:Drinking", "Expenses:Food")
+            f.write(appended)
+            f.flush()
+            p.update_ledger()
+            self.assertListEqual(parsed, [data, appended])
+            self.assertListEqual(
+                p.accounts,
+                ["Accounts:Cash", "Expenses:Drinking", "Expenses:Food"],
+            )
+            self.assertEqual(p.last_commodity_for_account["Expenses:Food"],
+                             "1.00 CHF")
+
+            rewritten = data.replace("beer", "wine").replace("Cash", "Bank")
+            f.seek(0)
+            f.write(rewritten)
+            f.truncate()
+            f.flush()
+            p.update_ledger()
+            self.assertListEqual(parsed[2:], [rewritten])
+            self.assertIn("Accounts:Bank", p.accounts)
+            self.assertNotIn("Accounts:Cash", p.accounts)
+
+    def test_appended_transactions_after_directives_are_not_parsed_alone(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        for directive in ("D 1000.00 CHF\n",
+                          "account Expenses:Food\n    alias Food\n"):
+            with tempfile.NamedTemporaryFile(mode="w") as f:
+                f.write(directive + data)
+                f.flush()
+                p = journal.JournalParser(f.name, None)
+                p.update_ledger()
+                self.assertTrue(p.ledger_text_has_context)
+
+                f.write(data)
+                f.flush()
+                parsed = []
+                worker = p._ledger_worker()
+                harvest = worker.harvest
+
+                def recording_harvest(text, stripped):
+                    parsed.append(text)
+                    return harvest(text, stripped)
+
+                worker.harvest = recording_harvest
+                p.update_ledger()
+                self.assertListEqual(parsed, [directive + data + data])
+
+    def test_sends_only_changes(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            p = journal.JournalParser(f.name, None)
+            cmd = journal.CMD_GET_A_LCFA_C
+            full = p.service((cmd, journal.UNCONDITIONAL, None, False),
+                             p.logger)
+            self.assertEqual(full[0], journal.FULL)
+            self.assertFalse(full[2])
+            self.assertListEqual(full[3],
+                                 ["Accounts:Cash", "Expenses:Drinking"])
+            self.assertListEqual(full[5], [0, 0])
+            self.assertEqual(
+                p.service((cmd, journal.IFCHANGED, full[1], False), p.logger),
+                journal.UNCHANGED,
+            )
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            f.write(data.replace("Expenses:Drinking", "Expenses:Food"))
+            f.flush()
+            delta, payees = p.service(
+                (journal.CMD_BATCH, [(cmd, journal.IFCHANGED, full[1], False),
+                                     (journal.CMD_GET_PAYEES,)]),
+                p.logger,
+            )
+            self.assertEqual(delta[0], journal.DELTA)
+            self.assertListEqual(delta[3], ["Expenses:Food"])
+            self.assertListEqual(delta[4], [])
+            self.assertListEqual(delta[5], [(2, 0)])
+            self.assertListEqual(payees, ["beer"])
+
+    def test_answers_stale_data_while_reparsing(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            p = journal.JournalParser(f.name, None)
+            cmd = journal.CMD_GET_A_LCFA_C
+            full = p.service((cmd, journal.UNCONDITIONAL, None, True),
+                             p.logger)
+            self.assertFalse(full[2])
+
+            parsed = threading.Event()
+            update_ledger = p.update_ledger
+
+            def slow_update_ledger(generation=None):
+                parsed.wait()
+                update_ledger(generation)
+
+            p.update_ledger = slow_update_ledger
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            f.write(data.replace("Expenses:Drinking", "Expenses:Food"))
+            f.flush()
+            stale = p.service((cmd, journal.IFCHANGED, full[1], True),
+                              p.logger)
+            self.assertEqual(stale[:3], (journal.DELTA, full[1], True))
+            self.assertListEqual(stale[3], [])
+            parsed.set()
+            fresh = p.service((cmd, journal.IFCHANGED, full[1], False),
+                              p.logger)
+            self.assertFalse(fresh[2])
+            self.assertListEqual(fresh[3], ["Expenses:Food"])
+
+    def test_harvests_keep_the_generation_they_parsed(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            p = journal.JournalParser(f.name, None)
+            cmd = journal.CMD_GET_A_LCFA_C
+            full = p.service((cmd, journal.UNCONDITIONAL, None, True),
+                             p.logger)
+
+            gates = [threading.Event(), threading.Event()]
+            read = []
+            get_text = p.get_journal_text_with_prices
+
+            def slow_get_text():
+                text = get_text()
+                read.append(text)
+                gates[len(read) - 1].wait()
+                return text
+
+            p.get_journal_text_with_prices = slow_get_text
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            f.write(data.replace("Expenses:Drinking", "Expenses:Food"))
+            f.flush()
+            p.service((cmd, journal.IFCHANGED, full[1], True), p.logger)
+            first = p.ledger_parsing_thread
+            while not read:
+                time.sleep(0.01)
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            f.write(data.replace("Expenses:Drinking", "Expenses:Wine"))
+            f.flush()
+            p.service((cmd, journal.IFCHANGED, full[1], True), p.logger)
+            gates[0].set()
+            first.join()
+            # The first parse read the journal before it changed again.
+            stale = p.service((cmd, journal.IFCHANGED, full[1], True),
+                              p.logger)
+            self.assertEqual(stale[:3], (journal.DELTA, full[1] + 1, True))
+            self.assertListEqual(stale[3], ["Expenses:Food"])
+
+            gates[1].set()
+            fresh = p.service((cmd, journal.IFCHANGED, stale[1], False),
+                              p.logger)
+            self.assertEqual(fresh[:3], (journal.DELTA, full[1] + 2, False))
+            self.assertListEqual(fresh[3], ["Expenses:Wine"])
+
+    def test_restarted_slave_answers_from_snapshot(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            self.addCleanup(setattr, journal, "_slave_context",
+                            journal._slave_context)
+            j = journal.Journal.from_file(f.name, None, fork_server=True)
+            accts, _ = j.accounts_and_last_commodity_for_account()
+            j.slave.terminate()
+            j.slave.join()
+
+            # Unbalanced, so ledger cannot parse the journal any more.
+            f.write("2015-03-16 broken\n    Expenses:Food  1.00 CHF\n"
+                    "    Accounts:Cash  1.00 CHF\n")
+            f.flush()
+            self.assertRaises(Exception,
+                              j.accounts_and_last_commodity_for_account)
+            stale, _ = j.accounts_and_last_commodity_for_account(True)
+            self.assertListEqual(stale, accts)
+            self.assertTrue(j.stale())
+            self.assertRaises(RuntimeError,
+                              j.accounts_and_last_commodity_for_account)
+
+    def test_journal_trains_suggester(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read()
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            suggester = m.AccountSuggester()
+            j = journal.Journal.from_file(f.name, None, suggester=suggester)
+            self.assertEqual(j.account_suggester().suggest("beer"),
+                             "Expenses:Drinking")
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            j.add_text_to_file(data.replace("beer", "wine"))
+            self.assertIs(j.account_suggester(), suggester)
+            self.assertEqual(
+                suggester.word_to_accounts["beer"]["Expenses:Drinking"], 1
+            )
+            self.assertEqual(suggester.suggest("wine"), "Expenses:Drinking")
+
+    def test_memory_mapped_journal(self):
+        with open(base.datapath("simple_transaction.dat")) as transaction_data:
+            data = transaction_data.read() * 2
+
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write(data)
+            f.flush()
+            j = journal.Journal.from_file(f.name, None, memory_map=True)
+            mapped = j.internal_parsing()[1]._buffer
+            self.assertIsInstance(mapped, journal.MappedFile)
+
+            time.sleep(0.01) # Wait a few ms to make sure st_mtime of the file changes
+            j.add_text_to_file(data.replace("beer", "wine"))
+            items = j.internal_parsing()
+            # The file is mapped once, and the map grows with it.
+            self.assertTrue(all(x._buffer is mapped for x in items))
+            self.assertEqual("".join(x.contents for x in items),
+                             data + data.replace("beer", "wine") + "\n")
+            self.assertListEqual(j.all_payees(), ["beer", "wine"])
+
+    def test_mapped_file_refuses_reads_past_truncation(self):
+        with tempfile.NamedTemporaryFile(mode="w") as f:
+            f.write("2015-03-12 beer\n" * 10)
+            f.flush()
+            mapped = journal.MappedFile(f.name)
+            self.assertEqual(mapped[0:15], b"2015-03-12 beer")
+            os.truncate(f.name, 10)
+            self.assertRaises(IOError, lambda: mapped[0:15])
+
     def test_transactions_with_payee_match(self):
         c = base.datapath("simple_transaction.dat")
         j = journal.Journal.from_file(c, None)
@@ -99,3 +446,122 @@ class TestGenerateRecord(T):
     expenses
 
 """.splitlines())
+
+
+class TestAccountSuggester(T):
+
+    def test_suggests_most_associated_account(self):
+        s = m.AccountSuggester()
+        self.assertIsNone(s.suggest("beer"))
+        s.associate("the pub beer", "Expenses:Drinking")
+        s.associate("the pub beer", "Expenses:Drinking")
+        s.associate("the grocery store", "Expenses:Food")
+        s.associate("The Store", "Expenses:Food")
+        self.assertEqual(s.suggest("Beer"), "Expenses:Drinking")
+        self.assertEqual(s.suggest("store"), "Expenses:Food")
+        self.assertEqual(s.suggest("the pub"), "Expenses:Drinking")
+        self.assertIsNone(s.suggest("wine"))
+
+    def test_weighted_discounts_common_words(self):
+        s = m.AccountSuggester()
+        for unused_i in range(3):
+            s.associate("the", "Expenses:Drinking")
+        s.associate("the grocery", "Expenses:Food")
+        s.associate("the rent", "Expenses:Housing")
+        s.associate("the bus", "Expenses:Transport")
+        s.associate("the doctor", "Expenses:Health")
+        self.assertEqual(s.suggest("the grocery"), "Expenses:Drinking")
+        self.assertEqual(s.suggest("the grocery", weighted=True),
+                         "Expenses:Food")
+
+    def test_unpickles_suggesters_without_index(self):
+        s = m.AccountSuggester()
+        s.associate("beer", "Expenses:Drinking")
+        old = m.AccountSuggester.__new__(m.AccountSuggester)
+        old.__dict__["account_to_words"] = s.account_to_words
+        s = pickle.loads(pickle.dumps(old))
+        self.assertEqual(s.suggest("beer"), "Expenses:Drinking")
+        s.associate("wine", "Expenses:Drinking")
+        self.assertEqual(s.suggest("wine"), "Expenses:Drinking")
+
+    def test_trains_from_journal(self):
+        text = (
+            "2015-10-20 The Pub\n"
+            "  Expenses:Drinking  1 CHF\n"
+            "  Assets:Cash\n"
+            "\n"
+            "2015-10-21 Grocery store\n"
+            "  Expenses:Food  2 CHF\n"
+            "  Assets:Cash\n"
+        )
+        s = m.AccountSuggester()
+        s.associate("pub", "Expenses:Drinking")
+        tokens = parser.lex_ledger_file_contents(text)
+        s.train_from_journal(tokens)
+        self.assertEqual(s.suggest("grocery"), "Expenses:Food")
+        self.assertEqual(s.suggest("pub"), "Expenses:Drinking")
+        appended = tokens[:3] + parser.lex_ledger_file_contents(
+            "2015-10-21 Grocery store\n"
+            "  Expenses:Drinking  2 CHF\n"
+            "  Assets:Cash\n"
+            "\n"
+            "2015-10-22 Grocery store\n"
+            "  Expenses:Drinking  2 CHF\n"
+            "  Assets:Cash\n"
+        )
+        s.train_from_journal(appended)
+        self.assertEqual(s.word_to_accounts["grocery"],
+                         {"Expenses:Drinking": 2})
+        s = pickle.loads(pickle.dumps(s))
+        self.assertEqual(s.word_to_accounts["pub"],
+                         {"Expenses:Drinking": 1})
+
+    def test_journal_training_skips_postings_money_comes_from(self):
+        text = (
+            "2015-10-20 Shop food\n"
+            "  Expenses:Food  1 CHF\n"
+            "  Assets:Cash\n"
+            "\n"
+            "2015-10-21 Shop food\n"
+            "  Expenses:Food  1 CHF\n"
+            "  Assets:Cash\n"
+            "\n"
+            "2015-10-22 Shop\n"
+            "  Assets:Cash  CHF -1\n"
+            "  Expenses:Car  CHF 1\n"
+        )
+        s = m.AccountSuggester()
+        s.train_from_journal(parser.lex_ledger_file_contents(text))
+        self.assertNotIn("Assets:Cash", s.word_to_accounts["shop"])
+        self.assertEqual(s.suggest("shop"), "Expenses:Food")
+        self.assertEqual(s.suggest("shop food", weighted=True),
+                         "Expenses:Food")
+
+
+class TestSettings(T):
+
+    def test_writes_only_on_flush(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "settings")
+            s = m.Settings.load_or_defaults(filename)
+            s["last_account"] = "Assets:Cash"
+            del s["nonexistent"]
+            self.assertFalse(os.path.exists(filename))
+            s.flush()
+            self.assertListEqual(os.listdir(d), ["settings"])
+            mtime = os.stat(filename).st_mtime_ns
+            s.flush()
+            self.assertEqual(os.stat(filename).st_mtime_ns, mtime)
+            s = m.Settings.load_or_defaults(filename)
+            self.assertEqual(s["last_account"], "Assets:Cash")
+            self.assertIsInstance(s["suggester"], m.AccountSuggester)
+            self.assertFalse(s.dirty)
+
+    def test_loads_uncompressed_settings(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "settings")
+            with open(filename, "wb") as f:
+                pickle.dump({"last_account": "Assets:Cash"}, f)
+            s = m.Settings.load_or_defaults(filename)
+            self.assertEqual(s["last_account"], "Assets:Cash")
+            s.flush()
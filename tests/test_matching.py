@@ -0,0 +1,156 @@
+import ledgerhelpers.matching as matching
+import ledgerhelpers.parser as parser
+from unittest import TestCase as T
+
+
+JOURNAL = """2015-01-01 Beer
+    Expenses:Drinking  1 CHF
+    Assets:Cash
+
+2015-01-02 Groceries
+    Expenses:Food  2 CHF
+    Assets:Cash
+
+2015-01-03 beer
+    Expenses:Drinking  3 CHF
+    Assets:Cash
+"""
+
+APPENDED = """
+2015-01-04 Wine
+    Expenses:Drinking  4 CHF
+    Assets:Cash
+"""
+
+
+class TestSubstringIndex(T):
+
+    def test_search(self):
+        index = matching.SubstringIndex(["beer", "root beer", "wine", "be"])
+        self.assertEqual(index.search("beer"), set(["beer", "root beer"]))
+        self.assertEqual(index.search("eer"), set(["beer", "root beer"]))
+        self.assertEqual(index.search("be"), set(["beer", "root beer", "be"]))
+        self.assertEqual(index.search("ot bee"), set(["root beer"]))
+        self.assertEqual(index.search("beers"), set())
+        self.assertEqual(index.search(""), index.strings)
+
+    def test_remove(self):
+        index = matching.SubstringIndex(["beer", "root beer"])
+        copy = index.copy()
+        index.remove("root beer")
+        self.assertEqual(index.search("bee"), set(["beer"]))
+        self.assertEqual(index.search("roo"), set())
+        self.assertEqual(copy.search("bee"), set(["beer", "root beer"]))
+
+
+class TestPayeeIndex(T):
+
+    def test_index(self):
+        tokens = parser.lex_ledger_file_contents(JOURNAL)
+        index = matching.PayeeIndex().updated(tokens)
+        self.assertListEqual(index.all_payees(), ["Beer", "Groceries", "beer"])
+        self.assertListEqual(
+            [t.date.day for t in index.transactions_with_payee("beer")],
+            [3],
+        )
+        self.assertListEqual(
+            [t.date.day for t in index.transactions_with_payee(
+                "BEER", case_sensitive=False
+            )],
+            [1, 3],
+        )
+        self.assertListEqual(index.search("EE"), ["Beer", "beer"])
+        self.assertListEqual(index.search("roc"), ["Groceries"])
+        self.assertListEqual(index.search("wine"), [])
+
+    def test_updated_matches_new_index(self):
+        tokens = parser.lex_ledger_file_contents(JOURNAL)
+        index = matching.PayeeIndex().updated(tokens)
+        appended = parser.lex_appended_ledger_file_contents(
+            tokens, JOURNAL + APPENDED, len(JOURNAL)
+        )
+        updated = index.updated(appended)
+        new = matching.PayeeIndex().updated(appended)
+        self.assertListEqual(updated.all_payees(), new.all_payees())
+        self.assertListEqual(updated.search("e"), new.search("e"))
+        for payee in new.all_payees():
+            self.assertListEqual(
+                updated.transactions_with_payee(payee, case_sensitive=False),
+                new.transactions_with_payee(payee, case_sensitive=False),
+            )
+        # The old index is left as it was.
+        self.assertListEqual(index.all_payees(), ["Beer", "Groceries", "beer"])
+        self.assertListEqual(index.search("wine"), [])
+        self.assertEqual(
+            len(index.transactions_with_payee("beer", case_sensitive=False)),
+            2,
+        )
+
+
+class TestCompleter(T):
+
+    def test_ranks_by_frequency_then_recency(self):
+        c = matching.Completer(["Beer", "Wine", "beer", "Wine", "Beer", "Tea"])
+        self.assertListEqual(c.complete(""), ["Beer", "Wine", "Tea", "beer"])
+        self.assertListEqual(c.complete("E"), ["Beer", "Wine", "Tea", "beer"])
+        self.assertListEqual(c.complete("bee"), ["Beer", "beer"])
+        self.assertListEqual(c.complete("in", limit=1), ["Wine"])
+        c.use("Tea")
+        c.use("Tea")
+        self.assertListEqual(c.complete("", limit=2), ["Tea", "Beer"])
+
+    def test_added_strings_rank_last(self):
+        c = matching.Completer(["Expenses:Food"])
+        c.add("Assets:Cash")
+        c.add("Expenses:Food")
+        self.assertListEqual(c.complete("s"), ["Expenses:Food", "Assets:Cash"])
+
+    def test_completers_for_journal(self):
+        tokens = parser.lex_ledger_file_contents(JOURNAL + APPENDED)
+        payees = matching.payee_completer(tokens)
+        self.assertListEqual(payees.complete("e"),
+                             ["Wine", "beer", "Groceries", "Beer"])
+        accounts = matching.account_completer(
+            ["Assets:Cash", "Expenses:Drinking", "Expenses:Food",
+             "Income:Salary"],
+            tokens,
+        )
+        self.assertListEqual(
+            accounts.complete("e"),
+            ["Expenses:Drinking", "Expenses:Food", "Assets:Cash",
+             "Income:Salary"],
+        )
+        self.assertListEqual(accounts.complete("expenses"),
+                             ["Expenses:Drinking", "Expenses:Food"])
+
+
+class TestAccountMatcher(T):
+
+    def test_segment_prefix_ranks_first(self):
+        m = matching.AccountMatcher(["Assets:Tax:Excise"] * 3)
+        m.add("Expenses:Food")
+        m.add("Assets:Cash")
+        self.assertListEqual(m.complete("ex"),
+                             ["Assets:Tax:Excise", "Expenses:Food"])
+        self.assertListEqual(m.complete("exp"), ["Expenses:Food"])
+        self.assertListEqual(m.complete("s"),
+                             ["Assets:Tax:Excise", "Assets:Cash",
+                              "Expenses:Food"])
+        self.assertListEqual(m.complete("as", limit=1), ["Assets:Tax:Excise"])
+        self.assertListEqual(m.complete("ca", limit=1), ["Assets:Cash"])
+        self.assertListEqual(m.complete("od"), ["Expenses:Food"])
+        self.assertListEqual(m.complete("xyz"), [])
+        m.use("Assets:Cash")
+        m.use("Assets:Cash")
+        m.use("Assets:Cash")
+        m.use("Assets:Cash")
+        self.assertListEqual(m.complete("as", limit=1), ["Assets:Cash"])
+
+    def test_accepts_more_than_the_matches_as_limit(self):
+        m = matching.AccountMatcher(["Expenses:Food", "Assets:Food bank"])
+        self.assertListEqual(m.complete("foo", limit=5),
+                             ["Assets:Food bank", "Expenses:Food"])
+        self.assertListEqual(m.complete("oo", limit=5),
+                             ["Assets:Food bank", "Expenses:Food"])
+        self.assertListEqual(m.complete("s:f", limit=5),
+                             ["Assets:Food bank", "Expenses:Food"])
@@ -1,4 +1,5 @@
 import datetime
+import io
 import ledgerhelpers.parser as parser
 import tests.test_base as base
 from unittest import TestCase as T
@@ -76,3 +77,277 @@ class TestParser(T):
         except IOError:
             return
         items = parser.lex_ledger_file_contents(c)
+
+
+class TestLineLexer(T):
+
+    cases = [
+        "",
+        "\n\n  \t\n",
+        "2015-01-01 x\n    a  1 USD\n    b\n",
+        "2015-01-01 x\n    a  1 USD\n    b",
+        "; comment\n# another\n2015-01-01 x\n a  1 USD\n b\n; trailing",
+        "; comment\n\n; separate\n",
+        "P 2015-01-01 USD 1 CHF\nP 2015-01-02 USD 2 CHF",
+        "C 1.00 Kb = 1024 b\n2015-01-01 x\n a\n",
+        "tag foo\n  check value\n\n; comment\n",
+        "tag foo\n  check value\n2015-01-01 x\n a\n",
+        "python\n  import os\n\nP 2015-01-01 USD 1 CHF\n",
+        "python\n  import os\n",
+        "include 2015.ledger\ninclude  years/*.ledger \n2015-01-01 x\n a\n",
+        "  2015-01-01 x\n a\n",
+    ]
+
+    def assertSameTokens(self, text):
+        reference = parser.LedgerTextLexer(text)
+        reference.run()
+        lexer = parser.LedgerTextLineLexer(text)
+        lexer.run()
+        self.assertEqual(
+            [(type(t), t.pos, t.contents) for t in reference.tokens],
+            [(type(t), t.pos, t.contents) for t in lexer.tokens],
+        )
+
+    def test_same_tokens_as_reference(self):
+        for case in self.cases:
+            self.assertSameTokens(case)
+        for f in ("simple_transaction.dat", "no_end_value.dat",
+                  "with_comments.dat", "zero.dat"):
+            self.assertSameTokens(base.data(f))
+
+    def test_same_errors_as_reference(self):
+        for case in [
+            "2015-01-01 x\n a\nbogus\n",
+            "2015-01-01 x\n\n\t a  1 USD\n",
+            "2015-01-01\n a\n",
+        ]:
+            with self.assertRaises(parser.LexingError) as reference:
+                parser.LedgerTextLexer(case).run()
+            with self.assertRaises(parser.LexingError) as lexer:
+                parser.LedgerTextLineLexer(case).run()
+            self.assertEqual(str(reference.exception), str(lexer.exception))
+
+
+class TestInclude(T):
+
+    def test_include_path(self):
+        items = parser.lex_ledger_file_contents(
+            "include 2015.ledger\ninclude  years/*.ledger \n"
+        )
+        self.assertListEqual(
+            [i.path for i in items if isinstance(i, parser.TokenInclude)],
+            ["2015.ledger", "years/*.ledger"],
+        )
+
+    def test_shared_token_count(self):
+        main = parser.lex_ledger_file_contents("include a.ledger\n\n")
+        a = parser.lex_ledger_file_contents(base.data("simple_transaction.dat"))
+        relexed = parser.lex_ledger_file_contents(
+            base.data("simple_transaction.dat")
+        )
+        # A file relexed in the middle of the journal ends what is shared.
+        self.assertEqual(
+            parser.shared_token_count(main[:1] + a + main[1:],
+                                      main[:1] + relexed + main[1:]),
+            1,
+        )
+        self.assertEqual(parser.shared_token_count(a, a + main), len(a))
+        self.assertEqual(parser.shared_token_count([], a), 0)
+
+
+class TestLazyTransaction(T):
+
+    def test_body_is_lexed_on_access(self):
+        items = parser.lex_ledger_file_contents("2015-01-01 \n    a  1 USD\n")
+        transaction = items[1]
+        self.assertEqual(transaction.date, datetime.date(2015, 1, 1))
+        with self.assertRaises(parser.TransactionLexingError) as e:
+            transaction.payee
+        self.assertEqual(
+            str(e.exception),
+            "bad ledger data in transaction '2015-01-01 ': "
+            "incomplete transaction",
+        )
+
+    def test_details_are_memoized(self):
+        c = base.data("simple_transaction.dat")
+        transaction = parser.lex_ledger_file_contents(c)[1]
+        self.assertIs(transaction.postings, transaction.postings)
+
+    def test_transaction_with_context_delegates(self):
+        comment = parser.TokenComment(7, "; note\n")
+        inner = parser.TokenTransaction(
+            38, "2015-01-01 * beer\n    a  1 USD\n    b\n"
+        )
+        transaction = parser.TokenTransactionWithContext(
+            38, [comment, inner]
+        )
+        self.assertEqual(transaction.date, datetime.date(2015, 1, 1))
+        self.assertEqual(transaction.payee, "beer")
+        self.assertEqual(transaction.state, parser.STATE_CLEARED)
+        self.assertEqual(transaction.postings[0].account, "a")
+
+
+class TestAppendedLexing(T):
+
+    def test_same_tokens_as_full_lexing(self):
+        prefixes = [
+            "",
+            "2015-01-01 x\n    a  1 USD\n    b\n",
+            "2015-01-01 x\n    a  1 USD\n    b",
+            "; comment\n",
+            "; comment",
+            "tag foo\n  check value\n",
+            base.data("simple_transaction.dat"),
+        ]
+        appendices = [
+            "",
+            "\n2015-01-02 y\n    a  2 USD\n    b\n",
+            "    c  3 USD\n",
+            "; more comment\n",
+            "P 2015-01-01 USD 1 CHF\n",
+        ]
+        for prefix in prefixes:
+            for appendix in appendices:
+                text = prefix + appendix
+                try:
+                    expected = parser.lex_ledger_file_contents(text)
+                except parser.LexingError:
+                    continue
+                previous = parser.lex_ledger_file_contents(prefix)
+                result = parser.lex_appended_ledger_file_contents(
+                    previous, text, len(prefix)
+                )
+                self.assertEqual(
+                    [(type(t), t.pos, t.contents) for t in expected],
+                    [(type(t), t.pos, t.contents) for t in result],
+                )
+
+
+class TestParallelLexing(T):
+
+    text = (
+        "; header\n"
+        "2015-01-01 x\n    a  1 USD\n    b\n\n"
+        "P 2015-01-01 USD 1 CHF\n"
+        "tag foo\n  check value\n"
+        "2015-01-02 y\n    a  2 USD\n    b\n"
+        "python\n  import os\n\n"
+        "include 2014.ledger\n"
+        "C 1.00 Kb = 1024 b\n"
+        "2015-01-03 z\n    a  3 USD\n    b\n"
+    )
+
+    def assertSameTokens(self, expected, tokens):
+        self.assertEqual(
+            [(type(t), t.pos, t.contents) for t in expected],
+            [(type(t), t.pos, t.contents) for t in tokens],
+        )
+
+    def test_chunks_join_like_whole_text(self):
+        expected = parser.lex_ledger_text_chunk(self.text)
+        for n in range(1, 10):
+            chunks = parser.split_ledger_text(self.text, n)
+            self.assertEqual("".join(chunks), self.text)
+            tokens = parser.join_ledger_text_chunks(
+                [parser.lex_ledger_text_chunk(c) for c in chunks]
+            )
+            self.assertSameTokens(expected, tokens)
+
+    def test_lexing_in_a_pool(self):
+        expected = parser.lex_ledger_text_chunk(self.text)
+        tokens = parser.lex_ledger_text_in_parallel(
+            self.text, 3, min_chunk_size=1
+        )
+        self.assertSameTokens(expected, tokens)
+
+    def test_errors_report_the_right_line(self):
+        text = self.text + "bogus\n"
+        with self.assertRaises(parser.LexingError) as expected:
+            parser.lex_ledger_text_chunk(text)
+        with self.assertRaises(parser.LexingError) as e:
+            parser.lex_ledger_text_in_parallel(text, 3, min_chunk_size=1)
+        self.assertEqual(str(expected.exception), str(e.exception))
+
+
+class TestStreamingLexing(T):
+
+    def test_same_tokens_as_whole_text(self):
+        text = TestParallelLexing.text
+        expected = parser.lex_ledger_text_chunk(text)
+        for chunk_size in (1, 16, 64, 4096):
+            tokens = list(parser.iter_ledger_tokens(io.StringIO(text),
+                                                    chunk_size))
+            self.assertEqual(
+                [(type(t), t.pos, t.contents) for t in expected],
+                [(type(t), t.pos, t.contents) for t in tokens],
+            )
+
+    def test_empty_file(self):
+        tokens = list(parser.iter_ledger_tokens(io.StringIO("")))
+        self.assertEqual([(type(t), t.contents) for t in tokens],
+                         [(parser.TokenWhitespace, "")])
+
+    def test_errors_report_the_right_line(self):
+        text = TestParallelLexing.text + "bogus\n"
+        with self.assertRaises(parser.LexingError) as expected:
+            parser.lex_ledger_text_chunk(text)
+        with self.assertRaises(parser.LexingError) as e:
+            list(parser.iter_ledger_tokens(io.StringIO(text), 16))
+        self.assertEqual(str(expected.exception), str(e.exception))
+
+
+class TestSharedBuffer(T):
+
+    def test_contents_come_from_buffer(self):
+        text = "; día\n" + base.data("simple_transaction.dat")
+        tokens = parser.lex_ledger_file_contents(text)
+        buffer = bytearray(("x" + text).encode("utf-8"))
+        end = parser.share_buffer(tokens, buffer, 1)
+        self.assertEqual(end, len(buffer))
+        buffer[0:1] = b"y"
+        self.assertEqual("".join(t.contents for t in tokens), text)
+        transaction = tokens[3]
+        self.assertIsNone(transaction._contents)
+        self.assertEqual(transaction.payee, "beer")
+
+
+class TestCompactTokens(T):
+
+    def test_tokens_have_no_dict(self):
+        c = base.data("with_comments.dat") + "P 2015-01-01 USD 1 CHF\n"
+        for token in parser.lex_ledger_file_contents(c):
+            self.assertFalse(hasattr(token, "__dict__"), type(token))
+        lexer = parser.LedgerTransactionLexer(c)
+        lexer.run()
+        for token in lexer.tokens:
+            self.assertFalse(hasattr(token, "__dict__"), type(token))
+
+
+class TestLineIndex(T):
+
+    def test_same_as_scanning(self):
+        for text in ["", "\n", "a\nbc\n\nd", base.data("with_comments.dat")]:
+            index = parser.LineIndex(text)
+            for pos in range(len(text) + 1):
+                expected = parser.pos_within_items_to_row_and_col(pos, text)
+                self.assertEqual(index.row_and_col(pos), expected)
+                self.assertEqual(index.line(pos), expected[0])
+
+
+class TestVerification(T):
+
+    def test_modes_give_the_same_tokens(self):
+        c = base.data("with_comments.dat") + TestParallelLexing.text
+        expected = parser.lex_ledger_file_contents(c)
+        for verify in (parser.VERIFY_CONTINUITY, parser.VERIFY_NONE):
+            tokens = parser.lex_ledger_file_contents(c, verify=verify)
+            self.assertEqual(
+                [(type(t), t.pos, t.contents) for t in expected],
+                [(type(t), t.pos, t.contents) for t in tokens],
+            )
+
+    def test_continuity_catches_gaps(self):
+        lexer = parser.LedgerTextLineLexer("2015-01-01 x\n a\n")
+        lexer.pos = 1
+        self.assertRaises(parser.LexingError, lexer.run)
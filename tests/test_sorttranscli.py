@@ -0,0 +1,34 @@
+import ledgerhelpers.parser as parser
+try:
+    import ledgerhelpers.programs.sorttranscli as sorttranscli
+except ImportError:
+    sorttranscli = None
+import unittest
+from unittest import TestCase as T
+
+
+@unittest.skipIf(sorttranscli is None, reason="ledger-python or GTK+ is not available on this system")
+class TestSortTransactions(T):
+
+    def test_sort(self):
+        c = (
+            "; header\n"
+            "2015-01-03 c\n    a  1 USD\n    b\n"
+            "P 2015-01-02 USD 1 CHF\n"
+            "2015-01-01 a\n    a  1 USD\n    b\n"
+            "; about b\n"
+            "2015-01-02 b\n    a  1 USD\n    b\n"
+            "2015-01-01 a again\n    a  1 USD\n    b\n"
+        )
+        items = parser.lex_ledger_file_contents(c)
+        result = "".join(i.contents for i in sorttranscli.sort_transactions(items))
+        self.assertEqual(
+            result,
+            "; header\n"
+            "P 2015-01-02 USD 1 CHF\n"
+            "2015-01-01 a\n    a  1 USD\n    b\n"
+            "2015-01-01 a again\n    a  1 USD\n    b\n"
+            "; about b\n"
+            "2015-01-02 b\n    a  1 USD\n    b\n"
+            "2015-01-03 c\n    a  1 USD\n    b\n"
+        )
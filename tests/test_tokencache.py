@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import ledgerhelpers.parser as parser
+import ledgerhelpers.tokencache as tokencache
+import tests.test_base as base
+from unittest import TestCase as T
+
+
+class TestTokenCache(T):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.journal = os.path.join(self.cache_dir, "journal.dat")
+        shutil.copy(base.datapath("with_comments.dat"), self.journal)
+        self.text = base.data("with_comments.dat")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def assertSameTokens(self, expected, tokens):
+        self.assertEqual(
+            [(type(t), t.pos, t.contents) for t in expected],
+            [(type(t), t.pos, t.contents) for t in tokens],
+        )
+
+    def test_round_trip(self):
+        expected = tokencache.lex_ledger_file_contents(
+            self.journal, self.text, self.cache_dir
+        )
+        tokens = tokencache.load(self.journal, self.text, self.cache_dir)
+        self.assertSameTokens(expected, tokens)
+        self.assertEqual(tokens[1].payee, "a gift!")
+
+    def test_no_cache_dir(self):
+        tokencache.lex_ledger_file_contents(self.journal, self.text)
+        self.assertListEqual(os.listdir(self.cache_dir), ["journal.dat"])
+
+    def test_changed_contents_are_not_loaded(self):
+        tokencache.lex_ledger_file_contents(
+            self.journal, self.text, self.cache_dir
+        )
+        self.assertIsNone(
+            tokencache.load(self.journal, self.text + "\n", self.cache_dir)
+        )
+
+    def test_transaction_with_context(self):
+        comment = parser.TokenComment(7, "; note\n")
+        transaction = parser.TokenTransaction(
+            38, "2015-01-01 * beer\n    a  1 USD\n    b\n"
+        )
+        expected = [
+            parser.TokenWhitespace(0, ""),
+            parser.TokenTransactionWithContext(2, [comment, transaction]),
+        ]
+        text = "".join(t.contents for t in expected)
+        records = tokencache.tokens_to_records(expected)
+        tokens = tokencache.records_to_tokens(records, text)
+        self.assertSameTokens(expected, tokens)
+        self.assertEqual(tokens[1].payee, "beer")
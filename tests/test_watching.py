@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import ledgerhelpers.watching as watching
+from unittest import TestCase as T
+
+
+try:
+    watching.InotifyWatcher([]).close()
+    inotify = True
+except (AttributeError, OSError):
+    inotify = False
+
+
+class WatcherTests(object):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journal.dat")
+        with open(self.path, "w") as f:
+            f.write("2015-03-12 beer\n")
+        self.watcher = self.klass([self.path, os.path.join(self.dir, "none")])
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.dir)
+
+    def test_changed(self):
+        self.assertTrue(self.watcher.changed())
+        self.assertFalse(self.watcher.changed())
+        with open(os.path.join(self.dir, "other.dat"), "w") as f:
+            f.write("unrelated")
+        self.assertFalse(self.watcher.changed())
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "a") as f:
+            f.write("2015-03-13 wine\n")
+        # Rewrites within the resolution of the modification time count.
+        os.utime(self.path, ns=(mtime, mtime))
+        self.assertTrue(self.watcher.changed())
+        self.assertFalse(self.watcher.changed())
+
+    def test_replaced_and_created(self):
+        self.watcher.changed()
+        tmp = os.path.join(self.dir, ".journal.tmp")
+        with open(tmp, "w") as f:
+            f.write("2015-03-12 beer\n")
+        os.rename(tmp, self.path)
+        self.assertTrue(self.watcher.changed())
+        with open(os.path.join(self.dir, "none"), "w"):
+            pass
+        self.assertTrue(self.watcher.changed())
+
+
+    def test_glob(self):
+        watcher = self.klass([os.path.join(self.dir, "*.inc")])
+        self.addCleanup(watcher.close)
+        self.assertTrue(watcher.changed())
+        with open(os.path.join(self.dir, ".hidden.inc"), "w"):
+            pass
+        with open(os.path.join(self.dir, "other.dat"), "w"):
+            pass
+        self.assertFalse(watcher.changed())
+        with open(os.path.join(self.dir, "new.inc"), "w"):
+            pass
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+
+
+class TestStatWatcher(WatcherTests, T):
+    klass = watching.StatWatcher
+
+
+@unittest.skipIf(not inotify, reason="inotify is not available on this system")
+class TestInotifyWatcher(WatcherTests, T):
+    klass = watching.InotifyWatcher
+
+    def test_wait(self):
+        self.watcher.changed()
+        start = time.time()
+        watching.wait([self.watcher], 0.05)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        with open(self.path, "a") as f:
+            f.write("\n")
+        start = time.time()
+        watching.wait([self.watcher], 10)
+        self.assertLess(time.time() - start, 5)
+        self.assertTrue(self.watcher.changed())
+
+
+class TestWatch(T):
+
+    def test_falls_back_to_stat(self):
+        with tempfile.TemporaryDirectory() as d:
+            w = watching.watch([os.path.join(d, "missing", "journal"), None])
+            self.assertIsInstance(w, watching.StatWatcher)
+            self.assertTrue(w.changed())
+            self.assertFalse(w.changed())